@@ -0,0 +1,217 @@
+"""
+Admission control for the inference path.
+
+At most max_concurrency images are processed at once per worker process.
+Work arrives in two lanes: interactive (uploads from the web page) and bulk
+(async jobs, bulk archives). Waiting work is dispatched by weighted fair
+queuing, so with the default weights four interactive images are started for
+every bulk image when both lanes are backed up, and bulk work may never hold
+the last `reserve` slots, which stay free for interactive traffic.
+
+Interactive callers that find their queue full (max_queue), or that wait
+longer than max_wait, are turned away straight away with Overloaded, which
+carries a Retry-After estimate based on an exponentially weighted average of
+recent service times. Bulk work waits for as long as it takes instead; its
+backlog mostly sits outside the controller (queued jobs, bulk archive
+windows), so callers pass it to check(), which refuses new bulk work once it
+reaches bulk_max_queue.
+
+When an interactive latency objective (slo, seconds) is given and the p95 of
+recent interactive requests exceeds it, bulk work is throttled to half its
+usual share until interactive latency recovers.
+
+Time spent waiting for a slot and time spent holding one are recorded as
+separate histograms per lane.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)
+
+QUEUE_SECONDS = metrics.Histogram('admission_queue_seconds', 'Time spent waiting for an inference slot.',
+                                  ['lane'])
+SERVICE_SECONDS = metrics.Histogram('admission_service_seconds', 'Time spent holding an inference slot.',
+                                    ['lane'])
+REJECTED = metrics.Counter('admission_rejected_total', 'Requests turned away by admission control.',
+                           ['lane', 'reason'])
+
+# Weight of the newest sample in the service time average
+_EWMA_ALPHA = 0.2
+# Interactive latencies kept for the p95 estimate, and for how long (seconds)
+_LATENCY_WINDOW = 200
+_LATENCY_HORIZON = 60
+# Bulk throttling is lifted once the interactive p95 is back under this share of the SLO
+_SLO_RECOVERY = 0.8
+
+
+class Overloaded(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    def __init__(self, lane, tag):
+        self.lane = lane
+        self.tag = tag
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency, max_queue, max_wait, weights=None, reserve=0, slo=None,
+                 bulk_max_queue=None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.max_queues = {INTERACTIVE: max_queue, BULK: max_queue if bulk_max_queue is None else bulk_max_queue}
+        self.max_wait = max_wait
+        self.weights = {INTERACTIVE: 1.0, BULK: 1.0, **(weights or {})}
+        # Bulk always keeps at least one slot so it cannot starve
+        self.bulk_limit = max(1, self.max_concurrency - reserve)
+        self.slo = slo
+        self._lock = threading.Lock()
+        self._queues = {lane: deque() for lane in LANES}
+        self._running = {lane: 0 for lane in LANES}
+        # Weighted fair queuing: virtual time and the last finish tag of each lane
+        self._virtual_time = 0.0
+        self._finish = {lane: 0.0 for lane in LANES}
+        self._service_time = None
+        self._latencies = deque(maxlen=_LATENCY_WINDOW)
+        self._throttled = False
+
+    def _retry_after(self, extra=0):
+        # Seconds until the current backlog, plus extra images waiting elsewhere, has drained at the recent pace
+        service_time = self._service_time or 1.0
+        backlog = sum(len(queue) for queue in self._queues.values()) + sum(self._running.values()) + extra
+        return max(1, math.ceil(backlog * service_time / self.max_concurrency))
+
+    def retry_after(self, extra=0):
+        with self._lock:
+            return self._retry_after(extra)
+
+    def _reject(self, lane, reason, extra=0):
+        REJECTED.inc(lane=lane, reason=reason)
+        return Overloaded("The server is busy, please try again shortly", self._retry_after(extra))
+
+    def _current_bulk_limit(self):
+        if self._throttled:
+            return max(1, self.bulk_limit // 2)
+        return self.bulk_limit
+
+    def _can_run(self, lane):
+        if sum(self._running.values()) >= self.max_concurrency:
+            return False
+        return lane != BULK or self._running[BULK] < self._current_bulk_limit()
+
+    def _would_wait(self, lane):
+        return bool(self._queues[lane]) or not self._can_run(lane)
+
+    def check(self, lane=INTERACTIVE, backlog=0):
+        """Raise Overloaded if a request in lane would be turned away now.
+
+        backlog is the lane's work waiting or in flight outside the controller.
+        """
+        with self._lock:
+            waiting = len(self._queues[lane]) + backlog
+            if (backlog or self._would_wait(lane)) and waiting >= self.max_queues[lane]:
+                raise self._reject(lane, 'queue_full', backlog)
+
+    @contextmanager
+    def slot(self, lane=INTERACTIVE):
+        """Hold an inference slot in lane for the duration of the block."""
+        waited = self._acquire(lane)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(lane, waited, time.perf_counter() - start)
+
+    def _dispatch(self):
+        # Start waiters, lowest finish tag first, while their lane may run
+        while True:
+            heads = [queue[0] for lane, queue in self._queues.items() if queue and self._can_run(lane)]
+            if not heads:
+                return
+            ticket = min(heads, key=lambda t: t.tag)
+            self._queues[ticket.lane].popleft()
+            self._running[ticket.lane] += 1
+            self._virtual_time = ticket.tag
+            ticket.granted = True
+            ticket.event.set()
+
+    def _acquire(self, lane):
+        start = time.perf_counter()
+        with self._lock:
+            if lane == INTERACTIVE and self._would_wait(lane) and len(self._queues[lane]) >= self.max_queue:
+                raise self._reject(lane, 'queue_full')
+            tag = max(self._virtual_time, self._finish[lane]) + 1.0 / self.weights[lane]
+            self._finish[lane] = tag
+            ticket = _Ticket(lane, tag)
+            self._queues[lane].append(ticket)
+            self._dispatch()
+
+        timeout = self.max_wait if lane == INTERACTIVE and self.max_wait > 0 else None
+        if not ticket.event.wait(timeout):
+            with self._lock:
+                # The slot may have been handed over just as the wait timed out
+                if not ticket.granted:
+                    self._queues[lane].remove(ticket)
+                    raise self._reject(lane, 'timeout')
+        waited = time.perf_counter() - start
+        QUEUE_SECONDS.observe(waited, lane=lane)
+        return waited
+
+    def _release(self, lane, waited, elapsed):
+        with self._lock:
+            if self._service_time is None:
+                self._service_time = elapsed
+            else:
+                self._service_time += _EWMA_ALPHA * (elapsed - self._service_time)
+            if self.slo:
+                if lane == INTERACTIVE:
+                    self._latencies.append((time.monotonic(), waited + elapsed))
+                p95 = self._p95()
+                if p95 > self.slo:
+                    self._throttled = True
+                elif p95 < self.slo * _SLO_RECOVERY:
+                    self._throttled = False
+            self._running[lane] -= 1
+            self._dispatch()
+        SERVICE_SECONDS.observe(elapsed, lane=lane)
+
+    def _p95(self):
+        # Old samples are dropped so bulk is not held back once interactive traffic stops
+        cutoff = time.monotonic() - _LATENCY_HORIZON
+        while self._latencies and self._latencies[0][0] < cutoff:
+            self._latencies.popleft()
+        if not self._latencies:
+            return 0.0
+        latencies = sorted(latency for _, latency in self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'running': sum(self._running.values()),
+                'queued': sum(len(queue) for queue in self._queues.values()),
+                'lanes': {lane: {'running': self._running[lane], 'queued': len(self._queues[lane]),
+                                 'max_queue': self.max_queues[lane], 'weight': self.weights[lane]}
+                          for lane in LANES},
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'bulk_limit': self._current_bulk_limit(),
+                'interactive_p95': round(self._p95(), 4),
+                'slo': self.slo,
+                'throttled': self._throttled,
+                'service_time_ewma': round(self._service_time or 0.0, 4),
+                'retry_after': self._retry_after(),
+            }
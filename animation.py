@@ -0,0 +1,189 @@
+"""
+Background removal for animated GIF, APNG, animated WebP and short MP4 clips.
+
+Frames are decoded lazily and handled in chunks of BATCH_MAX_SIZE, so the
+frames of a chunk that need the model share batched runs. A frame whose
+downsampled greyscale differs from the last predicted frame by less than
+ANIMATION_REUSE_THRESHOLD levels on average reuses that frame's mask instead
+of running the model, and ANIMATION_KEYFRAME_INTERVAL bounds how many frames
+in a row may reuse one mask, so slow drift is still picked up. On mostly
+static clips this skips the large majority of model runs.
+
+The result is an animation in the requested output format (APNG for png,
+animated WebP for webp and webp-lossy) with the source frame timing. MP4 has
+no alpha channel, so clips come back in those formats as well.
+"""
+
+import io
+import tempfile
+
+import cv2
+import numpy as np
+from PIL import Image, ImageChops, ImageSequence
+from rembg.bg import naive_cutout
+
+import config
+import encoding
+import metrics
+from batching import predict_masks
+from masks import crop_box
+from metrics import STAGE_SECONDS
+from uploads import sniff_image_type
+
+FRAMES = metrics.Counter('animation_frames_total', 'Animation frames by how their mask was obtained.',
+                         ['mask'])
+
+_ANIMATED_FORMATS = ('GIF', 'PNG', 'WEBP')
+# Size of the greyscale thumbnails compared to detect near-static frames
+_THUMB_SIZE = (64, 64)
+# Frame duration (ms) when the source does not give one
+_DEFAULT_DURATION = 100
+
+
+def is_video(data):
+    return sniff_image_type(data[:16]) == 'MP4'
+
+
+def frames(data):
+    """(frame iterator, loop count) for an animation or clip, or None for a still image.
+
+    The iterator yields (RGB image, duration in ms) pairs.
+    """
+    if is_video(data):
+        return _video_frames(data), 0
+    img = Image.open(io.BytesIO(data))
+    if img.format not in _ANIMATED_FORMATS or getattr(img, 'n_frames', 1) < 2:
+        return None
+    return _image_frames(img), img.info.get('loop', 0)
+
+
+def _fit(img):
+    """Downscale a frame so its longest side is at most ANIMATION_MAX_SIDE."""
+    scale = config.ANIMATION_MAX_SIDE / max(img.size)
+    if scale < 1:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                         Image.Resampling.BILINEAR)
+    return img
+
+
+def _limited(frames):
+    for count, frame in enumerate(frames):
+        if count >= config.ANIMATION_MAX_FRAMES:
+            raise ValueError(f"Animations may have at most {config.ANIMATION_MAX_FRAMES} frames")
+        yield frame
+
+
+def _image_frames(img):
+    default = img.info.get('duration') or _DEFAULT_DURATION
+    for frame in _limited(ImageSequence.Iterator(img)):
+        yield _fit(frame.convert('RGB')), frame.info.get('duration') or default
+
+
+def _video_frames(data):
+    # OpenCV only reads videos from a file
+    with tempfile.NamedTemporaryFile(suffix='.mp4') as f:
+        f.write(data)
+        f.flush()
+        capture = cv2.VideoCapture(f.name)
+        try:
+            if not capture.isOpened():
+                raise ValueError("Could not decode the video")
+            fps = capture.get(cv2.CAP_PROP_FPS)
+            duration = 1000 / fps if fps > 0 else _DEFAULT_DURATION
+
+            def read():
+                while True:
+                    ok, frame = capture.read()
+                    if not ok:
+                        return
+                    yield frame
+
+            for frame in _limited(read()):
+                yield _fit(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))), duration
+        finally:
+            capture.release()
+
+
+def _thumbnail(img):
+    return np.asarray(img.convert('L').resize(_THUMB_SIZE, Image.Resampling.BILINEAR), dtype=np.int16)
+
+
+class MaskReuse:
+    """Predicts masks for chunks of frames, reusing the last mask for near-static frames."""
+
+    def __init__(self, model_name=None):
+        self.model_name = model_name
+        self._thumbnail = None
+        self._mask = None
+        self._reused = 0
+
+    def _changed(self, thumbnail):
+        if self._thumbnail is None:
+            return True
+        if config.ANIMATION_KEYFRAME_INTERVAL and self._reused >= config.ANIMATION_KEYFRAME_INTERVAL:
+            return True
+        return np.abs(thumbnail - self._thumbnail).mean() >= config.ANIMATION_REUSE_THRESHOLD
+
+    def masks(self, chunk):
+        """Return one L mask per frame in chunk."""
+        # Index of the predicted frame each frame takes its mask from; -1 is the previous chunk
+        sources = []
+        keyframes = []
+        for i, frame in enumerate(chunk):
+            thumbnail = _thumbnail(frame)
+            if self._changed(thumbnail):
+                keyframes.append(i)
+                self._thumbnail = thumbnail
+                self._reused = 0
+            else:
+                self._reused += 1
+            sources.append(keyframes[-1] if keyframes else -1)
+
+        predicted = predict_masks([chunk[i] for i in keyframes], self.model_name) if keyframes else []
+        by_index = dict(zip(keyframes, predicted))
+        masks = [by_index[source] if source >= 0 else self._mask for source in sources]
+        self._mask = masks[-1]
+        FRAMES.inc(len(keyframes), mask='predicted')
+        FRAMES.inc(len(chunk) - len(keyframes), mask='reused')
+        return masks
+
+
+def _chunks(frames, size):
+    chunk = []
+    for frame in frames:
+        chunk.append(frame)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def remove_background(frames, loop=0, model_name=None, output_format='png', mask_only=False, crop=None):
+    """Remove the background from every frame and return the encoded animation.
+
+    frames and loop come from frames(); mask_only and crop work as for still
+    images, with one crop box (around the subject in any frame) for all frames.
+    """
+    reuse = MaskReuse(model_name)
+    cutouts, durations = [], []
+    union = None
+    for chunk in _chunks(frames, max(1, config.BATCH_MAX_SIZE)):
+        images = [img for img, _ in chunk]
+        with STAGE_SECONDS.time(stage='inference'):
+            masks = reuse.masks(images)
+        with STAGE_SECONDS.time(stage='postprocess'):
+            for img, mask in zip(images, masks):
+                cutouts.append(mask if mask_only else naive_cutout(img, mask))
+                if crop is not None:
+                    union = mask if union is None else ImageChops.lighter(union, mask)
+        durations.extend(duration for _, duration in chunk)
+    if not cutouts:
+        raise ValueError("The animation has no frames")
+
+    box = crop_box(union, crop) if union is not None else None
+    if box is not None:
+        cutouts = [cutout.crop(box) for cutout in cutouts]
+
+    with STAGE_SECONDS.time(stage='encode'):
+        return encoding.encode_animation(cutouts, durations, loop, output_format)
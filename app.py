@@ -1,28 +1,64 @@
-
 #!/usr/bin/env python3
 """
 Simple Flask Background Remover - Single File
 Save as: app.py
-Run with: python app.py
+Run with: python app.py (development server)
+In production: gunicorn -c gunicorn.conf.py wsgi:app
 
 Requirements:
-pip install flask rembg pillow
+pip install flask rembg pillow gunicorn
 """
 
-from flask import Flask, request, render_template_string, send_file, jsonify, redirect, url_for
+from flask import Blueprint, Flask, Request, Response, current_app, g, request, render_template, send_file, jsonify, redirect, url_for, stream_with_context
 import os
+import time
 import uuid
 import tempfile
 from rembg import remove
 from PIL import Image
 import io
+from functools import partial
+
+import assets
+import batching
+import bulk
+import config
+import encoding
+import inference_pool
+import metrics
+import sessions
+import admission
+from admission import AdmissionController, Overloaded
+from cache import ResultCache, cache_key
+from jobs import DONE, JobManager, JobsClosed, JobsFull
+from pipeline import remove_background, remove_background_outcome, warmup
+from storage import ResultStore
+from uploads import UploadError, read_upload
+
+class AppRequest(Request):
+    @property
+    def max_content_length(self):
+        # The bulk endpoint takes many images in one request
+        if self.endpoint == 'remover.create_batch':
+            return config.BULK_MAX_CONTENT_LENGTH
+        return super().max_content_length
+
+bp = Blueprint('remover', __name__)
 
-app = Flask(__name__)
-app.secret_key = 'your-secret-key-change-this'
+# Directory for processed images, the result store and cache, and the job
+# manager; created by setup() so that importing this module has no side effects
+UPLOAD_DIR = None
+results = None
+results_cache = None
+jobs = None
 
-# Create temp directory for uploads
-UPLOAD_DIR = tempfile.mkdtemp()
-print(f"📁 Temp directory: {UPLOAD_DIR}")
+MAX_FILE_SIZE = 16 * 1024 * 1024
+
+# CSS and JS live in static/ and are served fingerprinted from memory (loaded by setup())
+ASSETS = None
+ASSETS_BY_URL = None
+# Fingerprinted URLs never change content, so caches may keep them for a year
+ASSET_MAX_AGE = 365 * 24 * 3600
 
 # HTML Template
 HTML_TEMPLATE = """
@@ -32,165 +68,9 @@ HTML_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Background Remover</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            padding: 20px;
-        }
-        
-        .container {
-            background: white;
-            border-radius: 20px;
-            padding: 40px;
-            box-shadow: 0 20px 40px rgba(0,0,0,0.1);
-            max-width: 600px;
-            width: 100%;
-        }
-        
-        .header {
-            text-align: center;
-            margin-bottom: 30px;
-        }
-        
-        .header h1 {
-            color: #333;
-            font-size: 2.5em;
-            margin-bottom: 10px;
-        }
-        
-        .header p {
-            color: #666;
-            font-size: 1.1em;
-        }
-        
-        .upload-area {
-            border: 3px dashed #667eea;
-            border-radius: 15px;
-            padding: 50px 20px;
-            text-align: center;
-            margin: 30px 0;
-            transition: all 0.3s ease;
-            cursor: pointer;
-            position: relative;
-        }
-        
-        .upload-area:hover {
-            border-color: #764ba2;
-            background-color: rgba(102, 126, 234, 0.05);
-        }
-        
-        .upload-area.dragover {
-            border-color: #28a745;
-            background-color: rgba(40, 167, 69, 0.1);
-        }
-        
-        .upload-icon {
-            font-size: 4em;
-            color: #667eea;
-            margin-bottom: 20px;
-        }
-        
-        .file-input {
-            display: none !important;
-        }
-        
-        .btn {
-            background: linear-gradient(45deg, #667eea, #764ba2);
-            color: white;
-            border: none;
-            padding: 15px 40px;
-            border-radius: 50px;
-            font-size: 16px;
-            font-weight: 600;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            text-decoration: none;
-            display: inline-block;
-            margin: 10px;
-        }
-        
-        .btn:hover {
-            transform: translateY(-3px);
-            box-shadow: 0 10px 25px rgba(102, 126, 234, 0.3);
-        }
-        
-        .btn:active {
-            transform: translateY(-1px);
-        }
-        
-        .result {
-            text-align: center;
-            margin-top: 30px;
-        }
-        
-        .result img {
-            max-width: 100%;
-            border-radius: 15px;
-            box-shadow: 0 10px 25px rgba(0,0,0,0.1);
-            margin: 20px 0;
-        }
-        
-        .loading {
-            display: none;
-            text-align: center;
-            padding: 40px;
-        }
-        
-        .spinner {
-            width: 50px;
-            height: 50px;
-            border: 5px solid #f3f3f3;
-            border-top: 5px solid #667eea;
-            border-radius: 50%;
-            animation: spin 1s linear infinite;
-            margin: 0 auto 20px;
-        }
-        
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-        
-        .message {
-            padding: 15px;
-            border-radius: 10px;
-            margin: 20px 0;
-            text-align: center;
-        }
-        
-        .error {
-            background: #f8d7da;
-            color: #721c24;
-            border: 1px solid #f5c6cb;
-        }
-        
-        .success {
-            background: #d4edda;
-            color: #155724;
-            border: 1px solid #c3e6cb;
-        }
-        
-        .file-info {
-            background: rgba(102, 126, 234, 0.1);
-            padding: 15px;
-            border-radius: 10px;
-            margin: 15px 0;
-            text-align: left;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
 </head>
-<body>
+<body data-message-type="{{ message_type }}">
     <div class="container">
         <div class="header">
             <h1>🎨 Background Remover</h1>
@@ -207,8 +87,8 @@ HTML_TEMPLATE = """
             <div class="upload-area" id="uploadArea">
                 <div class="upload-icon">📁</div>
                 <h3>Drop your image here or click to browse</h3>
-                <p>Supports JPG, PNG, GIF, BMP, WebP (Max: 16MB)</p>
-                <input type="file" name="image" id="fileInput" accept="image/*" required style="display: none;">
+                <p>Supports JPG, PNG, GIF, BMP, WebP and MP4 clips (Max: 16MB)</p>
+                <input type="file" name="image" id="fileInput" accept="image/*,video/mp4" required style="display: none;">
             </div>
             
             <div id="fileInfo" class="file-info" style="display: none;">
@@ -216,6 +96,26 @@ HTML_TEMPLATE = """
                 <strong>Size:</strong> <span id="fileSize"></span>
             </div>
             
+            <div style="text-align: center;">
+                <label for="model"><strong>Model:</strong></label>
+                <select name="model" id="model">
+                    {% for name in models %}
+                    <option value="{{ name }}" {% if name == default_model %}selected{% endif %}>{{ name }}</option>
+                    {% endfor %}
+                </select>
+                <label for="format"><strong>Format:</strong></label>
+                <select name="format" id="format">
+                    <option value="">Default ({{ default_format }})</option>
+                    {% for name in formats %}
+                    <option value="{{ name }}">{{ name }}</option>
+                    {% endfor %}
+                </select>
+                <label><input type="checkbox" name="alpha_matting" value="1"> Refine edges (hair, fur)</label>
+                <label><input type="checkbox" name="crop" value="1"> Crop to subject</label>
+                <label><input type="checkbox" name="mask_only" value="1"> Mask only</label>
+                <label><input type="checkbox" name="tiled" value="1"> Tiled (panoramas, very large photos)</label>
+            </div>
+            
             <div style="text-align: center;">
                 <button type="submit" class="btn">✨ Remove Background</button>
             </div>
@@ -238,646 +138,398 @@ HTML_TEMPLATE = """
         {% endif %}
     </div>
 
-    <script>
-        const uploadArea = document.getElementById('uploadArea');
-        const fileInput = document.getElementById('fileInput');
-        const form = document.getElementById('uploadForm');
-        const loading = document.getElementById('loading');
-        const fileInfo = document.getElementById('fileInfo');
-        
-        let selectedFile = null; // Store the selected file
-        
-        // Prevent default drag behaviors
-        ['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
-            uploadArea.addEventListener(eventName, preventDefaults, false);
-            document.body.addEventListener(eventName, preventDefaults, false);
-        });
-        
-        // Highlight drop area when item is dragged over it
-        ['dragenter', 'dragover'].forEach(eventName => {
-            uploadArea.addEventListener(eventName, highlight, false);
-        });
-        
-        ['dragleave', 'drop'].forEach(eventName => {
-            uploadArea.addEventListener(eventName, unhighlight, false);
-        });
-        
-        // Handle dropped files
-        uploadArea.addEventListener('drop', handleDrop, false);
-        
-        // Handle file input change
-        fileInput.addEventListener('change', function(e) {
-            if (this.files && this.files[0]) {
-                selectedFile = this.files[0];
-                showFileInfo(selectedFile);
-            }
-        });
-        
-        // Handle click anywhere inside the upload area
-        uploadArea.addEventListener('click', function(e) {
-            // Only trigger if it's not a drag operation
-            if (!uploadArea.classList.contains('dragover')) {
-                fileInput.click();
-            }
-        });
-        
-        function preventDefaults(e) {
-            e.preventDefault();
-            e.stopPropagation();
-        }
-        
-        function highlight(e) {
-            uploadArea.classList.add('dragover');
-        }
-        
-        function unhighlight(e) {
-            uploadArea.classList.remove('dragover');
-        }
-        
-        function handleDrop(e) {
-            const dt = e.dataTransfer;
-            const files = dt.files;
-            
-            if (files.length > 0) {
-                selectedFile = files[0];
-                
-                // Create a new FileList and assign to input
-                const dataTransfer = new DataTransfer();
-                dataTransfer.items.add(selectedFile);
-                fileInput.files = dataTransfer.files;
-                
-                showFileInfo(selectedFile);
-            }
-        }
-        
-        function showFileInfo(file) {
-            document.getElementById('fileName').textContent = file.name;
-            document.getElementById('fileSize').textContent = (file.size / (1024*1024)).toFixed(2) + ' MB';
-            fileInfo.style.display = 'block';
-            
-            // Update upload area to show file is selected
-            uploadArea.style.borderColor = '#28a745';
-            uploadArea.style.backgroundColor = 'rgba(40, 167, 69, 0.1)';
-            uploadArea.querySelector('h3').textContent = '✅ File selected - Click "Remove Background" to process';
-        }
-        
-        // Handle form submission
-        form.addEventListener('submit', function(e) {
-            // Check if file is selected
-            if (!selectedFile || !fileInput.files || fileInput.files.length === 0) {
-                e.preventDefault();
-                alert('Please select an image file first!');
-                return false;
-            }
-            
-            // Show loading state
-            loading.style.display = 'block';
-            form.style.display = 'none';
-            
-            // Let the form submit normally
-            return true;
-        });
-        
-        // Reset function for "Process Another Image" button
-        function resetForm() {
-            selectedFile = null;
-            fileInput.value = '';
-            fileInfo.style.display = 'none';
-            uploadArea.style.borderColor = '#667eea';
-            uploadArea.style.backgroundColor = 'transparent';
-            uploadArea.querySelector('h3').textContent = 'Drop your image here or click to browse';
-            loading.style.display = 'none';
-            form.style.display = 'block';
-        }
-        
-        // Auto-reset if there's an error message
-        {% if message_type == 'error' %}
-        setTimeout(function() {
-            resetForm();
-        }, 100);
-        {% endif %}
-    </script>
+    <script src="{{ asset_url('app.js') }}"></script>
 </body>
 </html>
 """
 
-@app.route('/')
+def render_page(**context):
+    # The template is compiled once, in create_app()
+    return render_template(current_app.extensions['remover.template'], **context)
+
+admission_control = AdmissionController(
+    config.ADMISSION_MAX_CONCURRENCY, config.ADMISSION_MAX_QUEUE, config.ADMISSION_MAX_WAIT_MS / 1000,
+    weights={admission.INTERACTIVE: config.ADMISSION_INTERACTIVE_WEIGHT,
+             admission.BULK: config.ADMISSION_BULK_WEIGHT},
+    reserve=config.ADMISSION_INTERACTIVE_RESERVE,
+    slo=config.ADMISSION_INTERACTIVE_SLO_MS / 1000 or None,
+    bulk_max_queue=config.ADMISSION_BULK_MAX_QUEUE)
+
+def admitted_remove_background(input_data, lane=admission.BULK, **options):
+    """remove_background() once admission control grants an inference slot in lane."""
+    with admission_control.slot(lane):
+        return remove_background(input_data, **options)
+
+def process_upload(input_data, model_name=None, lane=admission.BULK, **options):
+    """Remove the background from an upload and return the result's file id.
+
+    Interactive uploads raise Overloaded instead of queueing behind a full queue.
+    """
+    key = cache_key(input_data, model_name or config.DEFAULT_MODEL, **options)
+    file_id = results_cache.get(key)
+    if file_id is not None:
+        print("♻️  Reusing cached result")
+        return file_id
+
+    file_id = str(uuid.uuid4())
+    with admission_control.slot(lane):
+        output, matted = remove_background_outcome(input_data, model_name=model_name, **options)
+    results.put(file_id, output, encoding.extension(options.get('output_format', 'png')))
+    # A matting fallback depends on the load at the time, so a later request may get refined edges
+    if matted is not False:
+        results_cache.put(key, file_id)
+    return file_id
+
+def setup():
+    """Load the static assets and create the result store, cache and job manager, once per process."""
+    global UPLOAD_DIR, results, results_cache, jobs, ASSETS, ASSETS_BY_URL
+    if results is not None:
+        return
+    ASSETS = assets.load()
+    ASSETS_BY_URL = {asset.url_name: asset for asset in ASSETS.values()}
+    # A fresh temp directory unless RESULT_DIR is set
+    UPLOAD_DIR = config.RESULT_DIR or tempfile.mkdtemp()
+    print(f"📁 Result directory: {UPLOAD_DIR}")
+    results = ResultStore(UPLOAD_DIR, config.RESULT_TTL, config.RESULT_MAX_BYTES,
+                          extensions=sorted(encoding.MIMETYPES))
+    results_cache = ResultCache(config.CACHE_MAX_ENTRIES, exists=results.exists)
+    # Job state is kept next to the results so any worker process can answer a poll
+    jobs = JobManager(process_upload, config.JOB_WORKERS, config.JOB_RETENTION,
+                      state_dir=os.path.join(UPLOAD_DIR, 'jobs'), max_queued=config.ADMISSION_MAX_QUEUE)
+
+def bulk_backlog():
+    """Bulk-lane images queued for a job worker or in flight in bulk archives."""
+    return jobs.queued() + bulk.in_flight()
+
+def requested_model():
+    """The model named by the request's `model` field, or None for the default."""
+    model_name = request.values.get('model') or None
+    if model_name is not None and model_name not in config.ALLOWED_MODELS:
+        raise UploadError(f"Unknown model '{model_name}'. "
+                          f"Available models: {', '.join(config.ALLOWED_MODELS)}", 400)
+    return model_name
+
+def requested_flag(name):
+    return request.values.get(name, '').lower() in ('1', 'true', 'on', 'yes')
+
+def requested_format():
+    """The `format` field, or with format=auto the best format the client accepts.
+
+    API requests without a format are negotiated too; the web form falls back
+    to OUTPUT_FORMAT, because browsers list image/webp in every Accept header.
+    """
+    output_format = request.values.get('format') or None
+    if output_format is None:
+        if not request.path.startswith('/api/'):
+            return config.OUTPUT_FORMAT
+        output_format = 'auto'
+    if output_format == 'auto':
+        return encoding.negotiate(request.accept_mimetypes)
+    if output_format not in encoding.available_formats():
+        raise UploadError(f"Unknown format '{output_format}'. "
+                          f"Available formats: {', '.join(encoding.available_formats())}", 400)
+    return output_format
+
+def requested_crop():
+    """Padding around the subject if the request asks for crop=1, otherwise None."""
+    if not requested_flag('crop'):
+        return None
+    padding = request.values.get('padding', config.CROP_PADDING)
+    try:
+        padding = int(padding)
+    except ValueError:
+        padding = -1
+    if padding < 0:
+        raise UploadError("padding must be a non-negative number of pixels", 400)
+    return padding
+
+def processing_options():
+    """remove_background() keyword arguments for the current request."""
+    mask_only = requested_flag('mask_only')
+    output_format = requested_format()
+    if mask_only:
+        # WebP and AVIF have no single-channel mode and would store the mask as RGB
+        output_format = 'png'
+    return {'model_name': requested_model(), 'alpha_matting': requested_flag('alpha_matting'),
+            'output_format': output_format, 'mask_only': mask_only,
+            'crop': requested_crop(), 'tiled': requested_flag('tiled')}
+
+@bp.app_context_processor
+def model_choices():
+    return {'models': config.ALLOWED_MODELS, 'default_model': config.DEFAULT_MODEL,
+            'formats': encoding.available_formats(), 'default_format': config.OUTPUT_FORMAT,
+            'asset_url': asset_url}
+
+def asset_url(name):
+    return url_for('remover.static_asset', name=ASSETS[name].url_name)
+
+# Metrics
+REQUEST_SECONDS = metrics.Histogram('http_request_seconds', 'HTTP request latency.', ['endpoint', 'status'])
+IN_FLIGHT = metrics.Gauge('http_requests_in_flight', 'HTTP requests currently being served.')
+BYTES_IN = metrics.Counter('http_received_bytes_total', 'Request body bytes received.')
+BYTES_OUT = metrics.Counter('http_sent_bytes_total', 'Response body bytes sent (when the length is known).')
+metrics.Callback('jobs', 'Async jobs by status.', lambda: {(k,): v for k, v in jobs.counts().items()}, ['status'])
+metrics.Callback('admission_queue_depth', 'Images waiting for an inference slot.',
+                 lambda: {(k,): v['queued'] for k, v in admission_control.stats()['lanes'].items()}, ['lane'])
+metrics.Callback('admission_in_flight', 'Images holding an inference slot.',
+                 lambda: {(k,): v['running'] for k, v in admission_control.stats()['lanes'].items()}, ['lane'])
+metrics.Callback('cache_hits_total', 'Result cache hits.', lambda: results_cache.hits, type='counter')
+metrics.Callback('cache_misses_total', 'Result cache misses.', lambda: results_cache.misses, type='counter')
+metrics.Callback('result_store_bytes', 'Disk space used by stored results.', lambda: results.stats()['bytes'])
+metrics.Callback('result_store_files', 'Number of stored results.', lambda: results.stats()['files'])
+metrics.Callback('result_store_evictions_total', 'Results removed by the janitor.',
+                 lambda: {(k,): v for k, v in results.stats()['evictions'].items()}, ['reason'], type='counter')
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    IN_FLIGHT.inc()
+    BYTES_IN.inc(request.content_length or 0)
+
+@bp.after_app_request
+def record_request_metrics(response):
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_start,
+                            endpoint=request.endpoint or 'unknown', status=response.status_code)
+    if response.content_length:
+        BYTES_OUT.inc(response.content_length)
+    return response
+
+@bp.teardown_app_request
+def finish_request(exc):
+    if 'request_start' in g:
+        IN_FLIGHT.dec()
+
+@bp.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    # The landing page never changes while the app runs: render it once
+    page = current_app.extensions.get('remover.index')
+    if page is None:
+        page = current_app.extensions['remover.index'] = render_page()
+    response = Response(page, mimetype='text/html')
+    response.add_etag()
+    return response.make_conditional(request)
+
+@bp.route('/static/<name>')
+def static_asset(name):
+    asset = ASSETS_BY_URL.get(name)
+    if asset is None:
+        return "File not found", 404
+    content_encoding = request.accept_encodings.best_match(list(asset.encodings), default='identity')
+    response = Response(asset.encodings[content_encoding], mimetype=asset.mimetype)
+    if content_encoding != 'identity':
+        response.content_encoding = content_encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(f"{asset.etag[:32]}-{content_encoding}")
+    response.cache_control.public = True
+    response.cache_control.max_age = ASSET_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
 
-@app.route('/', methods=['POST'])
+@bp.route('/', methods=['POST'])
 def upload():
     if 'image' not in request.files:
-        return render_template_string(HTML_TEMPLATE, 
-                                    message="No file selected", 
-                                    message_type="error")
+        return render_page(message="No file selected",
+                           message_type="error")
     
     file = request.files['image']
     if file.filename == '':
-        return render_template_string(HTML_TEMPLATE, 
-                                    message="No file selected", 
-                                    message_type="error")
+        return render_page(message="No file selected",
+                           message_type="error")
     
     try:
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
+        # Read uploaded file (checks the 16MB limit and the image type first)
+        input_data = read_upload(file, MAX_FILE_SIZE)
+        options = processing_options()
         
-        # Read uploaded file
-        input_data = file.read()
-        
-        # Validate file size (16MB limit)
-        if len(input_data) > 16 * 1024 * 1024:
-            return render_template_string(HTML_TEMPLATE, 
-                                        message="File too large. Maximum size is 16MB", 
-                                        message_type="error")
-        
-        # Remove background
+        # Remove background (or reuse the result of an identical upload)
         print("🔄 Processing image...")
-        output_data = remove(input_data)
-        
-        # Save processed image
-        output_path = os.path.join(UPLOAD_DIR, f"{file_id}.png")
-        with open(output_path, 'wb') as f:
-            f.write(output_data)
+        file_id = process_upload(input_data, lane=admission.INTERACTIVE, **options)
         
         print("✅ Image processed successfully!")
         
-        return render_template_string(HTML_TEMPLATE, 
-                                    result_image=file_id,
-                                    message="Background removed successfully!", 
-                                    message_type="success")
-        
+        return render_page(result_image=file_id,
+                           message="Background removed successfully!",
+                           message_type="success")
+        
+    except UploadError as e:
+        metrics.ERRORS.inc(type='UploadError')
+        return render_page(message=e.message,
+                           message_type="error"), e.status
+    except Overloaded as e:
+        return render_page(message=e.message,
+                           message_type="error"), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         print(f"❌ Error: {e}")
-        return render_template_string(HTML_TEMPLATE, 
-                                    message=f"Error processing image: {str(e)}", 
-                                    message_type="error")
+        return render_page(message=f"Error processing image: {str(e)}",
+                           message_type="error")
+
+@bp.app_errorhandler(413)
+def request_too_large(e):
+    metrics.ERRORS.inc(type='RequestEntityTooLarge')
+    message = "File too large. Maximum size is 16MB"
+    if request.path.startswith('/api/'):
+        return jsonify(error=message), 413
+    return render_page(message=message,
+                       message_type="error"), 413
+
+def send_result(file_path, **kwargs):
+    """Serve a stored result with a strong ETag and immutable caching.
+
+    send_file() answers If-None-Match with 304 and Range requests with 206.
+    """
+    response = send_file(file_path,
+                         mimetype=encoding.MIMETYPES[os.path.splitext(file_path)[1]],
+                         etag=results.etag(file_path),
+                         max_age=config.RESULT_CACHE_MAX_AGE,
+                         **kwargs)
+    response.cache_control.immutable = True
+    # Werkzeug only sets this on 206 responses; advertise it up front
+    response.accept_ranges = 'bytes'
+    return response
 
-@app.route('/result/<file_id>')
+@bp.route('/result/<file_id>')
 def show_result(file_id):
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}.png")
-    if os.path.exists(file_path):
-        return send_file(file_path, mimetype='image/png')
+    file_path = results.get_path(file_id)
+    if file_path:
+        return send_result(file_path)
     return "File not found", 404
 
-@app.route('/download/<file_id>')
+@bp.route('/download/<file_id>')
 def download_result(file_id):
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}.png")
-    if os.path.exists(file_path):
-        return send_file(file_path, 
-                        as_attachment=True, 
-                        download_name=f"no_background_{file_id}.png",
-                        mimetype='image/png')
+    file_path = results.get_path(file_id)
+    if file_path:
+        extension = os.path.splitext(file_path)[1]
+        return send_result(file_path, 
+                           as_attachment=True, 
+                           download_name=f"no_background_{file_id}{extension}")
     return "File not found", 404
 
-if __name__ == '__main__':
-    print("🚀 Starting Background Remover...")
-    print("📱 Open: http://127.0.0.1:5000")
-    print("⏹️  Press Ctrl+C to stop")
-    print("-" * 50)
-    
+def job_status(job):
+    status = job.to_dict()
+    status['status_url'] = url_for('.get_job', job_id=job.id)
+    if job.status == DONE:
+        status['result_url'] = url_for('.show_result', file_id=job.result_id)
+        status['download_url'] = url_for('.download_result', file_id=job.result_id)
+    return status
+
+@bp.route('/api/jobs', methods=['POST'])
+def create_job():
+    file = request.files.get('image')
+    if file is None or file.filename == '':
+        return jsonify(error="No file selected"), 400
+
     try:
-        app.run(debug=True, host='127.0.0.1', port=5000)
-    except KeyboardInterrupt:
-        print("\n👋 Server stopped!")
-    finally:
-        # Cleanup temp directory
-        import shutil
-        try:
-            shutil.rmtree(UPLOAD_DIR)
-            print("🧹 Cleaned up temporary files")
-        except:
+        input_data = read_upload(file, MAX_FILE_SIZE)
+        options = processing_options()
+    except UploadError as e:
+        metrics.ERRORS.inc(type='UploadError')
+        return jsonify(error=e.message), e.status
 
+    try:
+        admission_control.check(admission.BULK, bulk_backlog())
+        job = jobs.submit(input_data, **options)
+    except Overloaded as e:
+        return jsonify(error=e.message), 503, {'Retry-After': str(e.retry_after)}
+    except JobsFull as e:
+        admission.REJECTED.inc(lane=admission.BULK, reason='jobs_full')
+        return jsonify(error=str(e)), 503, {'Retry-After': str(admission_control.retry_after(jobs.queued()))}
+    except JobsClosed as e:
+        return jsonify(error=str(e)), 503
+    response = jsonify(job_status(job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('.get_job', job_id=job.id)
+    return response
 
-"""
-Simple Flask Background Remover - Single File
-Save as: app.py
-Run with: python app.py
+@bp.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(error="Job not found"), 404
+    return jsonify(job_status(job))
 
-Requirements:
-pip install flask rembg pillow
-"""
+@bp.route('/api/batch', methods=['POST'])
+def create_batch():
+    files = [f for f in request.files.getlist('images') + request.files.getlist('image')
+             if f.filename != '']
+    if not files:
+        return jsonify(error="No file selected"), 400
+    try:
+        options = processing_options()
+        admission_control.check(admission.BULK, bulk_backlog())
+    except UploadError as e:
+        metrics.ERRORS.inc(type='UploadError')
+        return jsonify(error=e.message), e.status
+    except Overloaded as e:
+        return jsonify(error=e.message), 503, {'Retry-After': str(e.retry_after)}
 
-from flask import Flask, request, render_template_string, send_file, jsonify, redirect, url_for
-import os
-import uuid
-import tempfile
-from rembg import remove
-from PIL import Image
-import io
+    inputs = bulk.iter_inputs(files, MAX_FILE_SIZE)
+    executor = bulk.get_executor(config.BULK_WORKERS)
+    chunks = bulk.stream_zip(inputs, partial(admitted_remove_background, **options), executor,
+                             window=config.BULK_WORKERS * 2,
+                             max_files=config.BULK_MAX_FILES,
+                             extension=encoding.extension(options['output_format']))
+    return Response(stream_with_context(chunks), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=no_background.zip'})
 
-app = Flask(__name__)
-app.secret_key = 'your-secret-key-change-this'
+@bp.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-# Create temp directory for uploads
-UPLOAD_DIR = tempfile.mkdtemp()
-print(f"📁 Temp directory: {UPLOAD_DIR}")
+@bp.route('/api/stats')
+def stats():
+    return jsonify(models=sessions.loaded_models(), onnxruntime=sessions.runtime_settings(), batching=batching.stats(), jobs=jobs.counts(),
+                   cache=results_cache.stats(), storage=results.stats(), admission=admission_control.stats(),
+                   inference_pool=inference_pool.stats())
 
-# HTML Template
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Background Remover</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            padding: 20px;
-        }
-        
-        .container {
-            background: white;
-            border-radius: 20px;
-            padding: 40px;
-            box-shadow: 0 20px 40px rgba(0,0,0,0.1);
-            max-width: 600px;
-            width: 100%;
-        }
-        
-        .header {
-            text-align: center;
-            margin-bottom: 30px;
-        }
-        
-        .header h1 {
-            color: #333;
-            font-size: 2.5em;
-            margin-bottom: 10px;
-        }
-        
-        .header p {
-            color: #666;
-            font-size: 1.1em;
-        }
-        
-        .upload-area {
-            border: 3px dashed #667eea;
-            border-radius: 15px;
-            padding: 50px 20px;
-            text-align: center;
-            margin: 30px 0;
-            transition: all 0.3s ease;
-            cursor: pointer;
-            position: relative;
-        }
-        
-        .upload-area:hover {
-            border-color: #764ba2;
-            background-color: rgba(102, 126, 234, 0.05);
-        }
-        
-        .upload-area.dragover {
-            border-color: #28a745;
-            background-color: rgba(40, 167, 69, 0.1);
-        }
-        
-        .upload-icon {
-            font-size: 4em;
-            color: #667eea;
-            margin-bottom: 20px;
-        }
-        
-        .file-input {
-            display: none !important;
-        }
-        
-        .btn {
-            background: linear-gradient(45deg, #667eea, #764ba2);
-            color: white;
-            border: none;
-            padding: 15px 40px;
-            border-radius: 50px;
-            font-size: 16px;
-            font-weight: 600;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            text-decoration: none;
-            display: inline-block;
-            margin: 10px;
-        }
-        
-        .btn:hover {
-            transform: translateY(-3px);
-            box-shadow: 0 10px 25px rgba(102, 126, 234, 0.3);
-        }
-        
-        .btn:active {
-            transform: translateY(-1px);
-        }
-        
-        .result {
-            text-align: center;
-            margin-top: 30px;
-        }
-        
-        .result img {
-            max-width: 100%;
-            border-radius: 15px;
-            box-shadow: 0 10px 25px rgba(0,0,0,0.1);
-            margin: 20px 0;
-        }
-        
-        .loading {
-            display: none;
-            text-align: center;
-            padding: 40px;
-        }
-        
-        .spinner {
-            width: 50px;
-            height: 50px;
-            border: 5px solid #f3f3f3;
-            border-top: 5px solid #667eea;
-            border-radius: 50%;
-            animation: spin 1s linear infinite;
-            margin: 0 auto 20px;
-        }
-        
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-        
-        .message {
-            padding: 15px;
-            border-radius: 10px;
-            margin: 20px 0;
-            text-align: center;
-        }
-        
-        .error {
-            background: #f8d7da;
-            color: #721c24;
-            border: 1px solid #f5c6cb;
-        }
-        
-        .success {
-            background: #d4edda;
-            color: #155724;
-            border: 1px solid #c3e6cb;
-        }
-        
-        .file-info {
-            background: rgba(102, 126, 234, 0.1);
-            padding: 15px;
-            border-radius: 10px;
-            margin: 15px 0;
-            text-align: left;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🎨 Background Remover</h1>
-            <p>Upload an image and remove its background instantly using AI</p>
-        </div>
-        
-        {% if message %}
-        <div class="message {{ message_type }}">
-            {{ message }}
-        </div>
-        {% endif %}
-        
-        <form id="uploadForm" method="post" enctype="multipart/form-data">
-            <div class="upload-area" id="uploadArea">
-                <div class="upload-icon">📁</div>
-                <h3>Drop your image here or click to browse</h3>
-                <p>Supports JPG, PNG, GIF, BMP, WebP (Max: 16MB)</p>
-                <input type="file" name="image" id="fileInput" accept="image/*" required style="display: none;">
-            </div>
-            
-            <div id="fileInfo" class="file-info" style="display: none;">
-                <strong>Selected file:</strong> <span id="fileName"></span><br>
-                <strong>Size:</strong> <span id="fileSize"></span>
-            </div>
-            
-            <div style="text-align: center;">
-                <button type="submit" class="btn">✨ Remove Background</button>
-            </div>
-        </form>
-        
-        <div id="loading" class="loading">
-            <div class="spinner"></div>
-            <h3>Processing your image...</h3>
-            <p>This usually takes 5-10 seconds</p>
-        </div>
-        
-        {% if result_image %}
-        <div class="result">
-            <h2>✅ Background Removed Successfully!</h2>
-            <img src="/result/{{ result_image }}" alt="Processed Image">
-            <br>
-            <a href="/download/{{ result_image }}" class="btn">💾 Download Image</a>
-            <a href="/" class="btn">➕ Process Another Image</a>
-        </div>
-        {% endif %}
-    </div>
+def create_app():
+    """Build the Flask application.
 
-    <script>
-        const uploadArea = document.getElementById('uploadArea');
-        const fileInput = document.getElementById('fileInput');
-        const form = document.getElementById('uploadForm');
-        const loading = document.getElementById('loading');
-        const fileInfo = document.getElementById('fileInfo');
-        
-        let selectedFile = null; // Store the selected file
-        
-        // Prevent default drag behaviors
-        ['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
-            uploadArea.addEventListener(eventName, preventDefaults, false);
-            document.body.addEventListener(eventName, preventDefaults, false);
-        });
-        
-        // Highlight drop area when item is dragged over it
-        ['dragenter', 'dragover'].forEach(eventName => {
-            uploadArea.addEventListener(eventName, highlight, false);
-        });
-        
-        ['dragleave', 'drop'].forEach(eventName => {
-            uploadArea.addEventListener(eventName, unhighlight, false);
-        });
-        
-        // Handle dropped files
-        uploadArea.addEventListener('drop', handleDrop, false);
-        
-        // Handle file input change
-        fileInput.addEventListener('change', function(e) {
-            if (this.files && this.files[0]) {
-                selectedFile = this.files[0];
-                showFileInfo(selectedFile);
-            }
-        });
-        
-        // Handle click anywhere inside the upload area
-        uploadArea.addEventListener('click', function(e) {
-            // Only trigger if it's not a drag operation
-            if (!uploadArea.classList.contains('dragover')) {
-                fileInput.click();
-            }
-        });
-        
-        function preventDefaults(e) {
-            e.preventDefault();
-            e.stopPropagation();
-        }
-        
-        function highlight(e) {
-            uploadArea.classList.add('dragover');
-        }
-        
-        function unhighlight(e) {
-            uploadArea.classList.remove('dragover');
-        }
-        
-        function handleDrop(e) {
-            const dt = e.dataTransfer;
-            const files = dt.files;
-            
-            if (files.length > 0) {
-                selectedFile = files[0];
-                
-                // Create a new FileList and assign to input
-                const dataTransfer = new DataTransfer();
-                dataTransfer.items.add(selectedFile);
-                fileInput.files = dataTransfer.files;
-                
-                showFileInfo(selectedFile);
-            }
-        }
-        
-        function showFileInfo(file) {
-            document.getElementById('fileName').textContent = file.name;
-            document.getElementById('fileSize').textContent = (file.size / (1024*1024)).toFixed(2) + ' MB';
-            fileInfo.style.display = 'block';
-            
-            // Update upload area to show file is selected
-            uploadArea.style.borderColor = '#28a745';
-            uploadArea.style.backgroundColor = 'rgba(40, 167, 69, 0.1)';
-            uploadArea.querySelector('h3').textContent = '✅ File selected - Click "Remove Background" to process';
-        }
-        
-        // Handle form submission
-        form.addEventListener('submit', function(e) {
-            // Check if file is selected
-            if (!selectedFile || !fileInput.files || fileInput.files.length === 0) {
-                e.preventDefault();
-                alert('Please select an image file first!');
-                return false;
-            }
-            
-            // Show loading state
-            loading.style.display = 'block';
-            form.style.display = 'none';
-            
-            // Let the form submit normally
-            return true;
-        });
-        
-        // Reset function for "Process Another Image" button
-        function resetForm() {
-            selectedFile = null;
-            fileInput.value = '';
-            fileInfo.style.display = 'none';
-            uploadArea.style.borderColor = '#667eea';
-            uploadArea.style.backgroundColor = 'transparent';
-            uploadArea.querySelector('h3').textContent = 'Drop your image here or click to browse';
-            loading.style.display = 'none';
-            form.style.display = 'block';
-        }
-        
-        // Auto-reset if there's an error message
-        {% if message_type == 'error' %}
-        setTimeout(function() {
-            resetForm();
-        }, 100);
-        {% endif %}
-    </script>
-</body>
-</html>
-"""
+    Importing this module has no side effects. Creating the app sets up the
+    result directory, store and job manager (see setup()) but starts no threads
+    and loads no models, so it is safe in a preloading master process; call
+    start_worker() in each process that serves requests.
+    """
+    setup()
+    # static/ is served by the blueprint, fingerprinted and precompressed
+    app = Flask(__name__, static_folder=None)
+    app.request_class = AppRequest
+    app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
+    # Let Werkzeug reject oversized request bodies before buffering them
+    # (with some headroom for the multipart headers)
+    app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE + 64 * 1024
+    app.register_blueprint(bp)
+    app.extensions['remover.template'] = app.jinja_env.from_string(HTML_TEMPLATE)
+    return app
 
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
+def preload():
+    """Fetch model files before worker processes are forked.
 
-@app.route('/', methods=['POST'])
-def upload():
-    if 'image' not in request.files:
-        return render_template_string(HTML_TEMPLATE, 
-                                    message="No file selected", 
-                                    message_type="error")
-    
-    file = request.files['image']
-    if file.filename == '':
-        return render_template_string(HTML_TEMPLATE, 
-                                    message="No file selected", 
-                                    message_type="error")
-    
-    try:
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
-        
-        # Read uploaded file
-        input_data = file.read()
-        
-        # Validate file size (16MB limit)
-        if len(input_data) > 16 * 1024 * 1024:
-            return render_template_string(HTML_TEMPLATE, 
-                                        message="File too large. Maximum size is 16MB", 
-                                        message_type="error")
-        
-        # Remove background
-        print("🔄 Processing image...")
-        output_data = remove(input_data)
-        
-        # Save processed image
-        output_path = os.path.join(UPLOAD_DIR, f"{file_id}.png")
-        with open(output_path, 'wb') as f:
-            f.write(output_data)
-        
-        print("✅ Image processed successfully!")
-        
-        return render_template_string(HTML_TEMPLATE, 
-                                    result_image=file_id,
-                                    message="Background removed successfully!", 
-                                    message_type="success")
-        
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        return render_template_string(HTML_TEMPLATE, 
-                                    message=f"Error processing image: {str(e)}", 
-                                    message_type="error")
+    Sessions themselves are not created here: onnxruntime's thread pools do not
+    survive fork(), so each worker builds its own in start_worker(). What the
+    workers share copy-on-write is everything imported so far plus the model
+    files in the page cache, and N workers no longer race to download them.
+    """
+    for model_name in dict.fromkeys([config.DEFAULT_MODEL] + config.WARMUP_MODELS):
+        print(f"📦 Preloading model '{model_name}'...")
+        sessions.fetch_model(model_name)
 
-@app.route('/result/<file_id>')
-def show_result(file_id):
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}.png")
-    if os.path.exists(file_path):
-        return send_file(file_path, mimetype='image/png')
-    return "File not found", 404
+def start_worker():
+    """Start this process's background threads and warm up its models."""
+    print("⚙️  onnxruntime: " + ", ".join(f"{k}={v}" for k, v in sessions.runtime_settings().items()))
+    inference_pool.start()
+    results.start_janitor(config.JANITOR_INTERVAL)
+    for model_name in config.WARMUP_MODELS:
+        print(f"🔥 Warming up model '{model_name}'...")
+        warmup(model_name)
 
-@app.route('/download/<file_id>')
-def download_result(file_id):
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}.png")
-    if os.path.exists(file_path):
-        return send_file(file_path, 
-                        as_attachment=True, 
-                        download_name=f"no_background_{file_id}.png",
-                        mimetype='image/png')
-    return "File not found", 404
+def shutdown():
+    """Stop taking jobs and wait for the queued and running ones to finish."""
+    print("⏳ Draining background jobs...")
+    start = time.monotonic()
+    jobs.shutdown(wait=True)
+    results.stop_janitor()
+    inference_pool.stop()
+    print(f"👋 Jobs drained in {time.monotonic() - start:.1f}s")
 
 if __name__ == '__main__':
     print("🚀 Starting Background Remover...")
@@ -885,16 +537,20 @@ if __name__ == '__main__':
     print("⏹️  Press Ctrl+C to stop")
     print("-" * 50)
     
+    app = create_app()
+    start_worker()
     try:
-        app.run(debug=True, host='127.0.0.1', port=5000)
+        # Development server; debugging is opt-in with FLASK_DEBUG=1
+        app.run(host='127.0.0.1', port=5000)
     except KeyboardInterrupt:
         print("\n👋 Server stopped!")
     finally:
-        # Cleanup temp directory
+        shutdown()
+        # Cleanup temp directory (a configured RESULT_DIR is kept)
         import shutil
         try:
-            shutil.rmtree(UPLOAD_DIR)
-            print("🧹 Cleaned up temporary files")
+            if not config.RESULT_DIR:
+                shutil.rmtree(UPLOAD_DIR)
+                print("🧹 Cleaned up temporary files")
         except:
-
-            pass
\ No newline at end of file
+            pass
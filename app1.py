@@ -16,6 +16,9 @@ from rembg import remove
 from PIL import Image
 import io
 
+from pipeline import remove_background
+from uploads import UploadError, read_upload
+
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'
 
@@ -23,6 +26,11 @@ app.secret_key = 'your-secret-key-change-this'
 UPLOAD_DIR = tempfile.mkdtemp()
 print(f"📁 Temp directory: {UPLOAD_DIR}")
 
+MAX_FILE_SIZE = 16 * 1024 * 1024
+# Let Werkzeug reject oversized request bodies before buffering them
+# (with some headroom for the multipart headers)
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE + 64 * 1024
+
 # HTML Template
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -325,18 +333,12 @@ def upload():
         # Generate unique filename
         file_id = str(uuid.uuid4())
         
-        # Read uploaded file
-        input_data = file.read()
-        
-        # Validate file size (16MB limit)
-        if len(input_data) > 16 * 1024 * 1024:
-            return render_template_string(HTML_TEMPLATE, 
-                                        message="File too large. Maximum size is 16MB", 
-                                        message_type="error")
+        # Read uploaded file (checks the 16MB limit and the image type first)
+        input_data = read_upload(file, MAX_FILE_SIZE)
         
         # Remove background
         print("🔄 Processing image...")
-        output_data = remove(input_data)
+        output_data = remove_background(input_data)
         
         # Save processed image
         output_path = os.path.join(UPLOAD_DIR, f"{file_id}.png")
@@ -350,12 +352,22 @@ def upload():
                                     message="Background removed successfully!", 
                                     message_type="success")
         
+    except UploadError as e:
+        return render_template_string(HTML_TEMPLATE, 
+                                    message=e.message, 
+                                    message_type="error"), e.status
     except Exception as e:
         print(f"❌ Error: {e}")
         return render_template_string(HTML_TEMPLATE, 
                                     message=f"Error processing image: {str(e)}", 
                                     message_type="error")
 
+@app.errorhandler(413)
+def request_too_large(e):
+    return render_template_string(HTML_TEMPLATE, 
+                                message="File too large. Maximum size is 16MB", 
+                                message_type="error"), 413
+
 @app.route('/result/<file_id>')
 def show_result(file_id):
     file_path = os.path.join(UPLOAD_DIR, f"{file_id}.png")
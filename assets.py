@@ -0,0 +1,52 @@
+"""
+Fingerprinted, precompressed static assets.
+
+Files in static/ are read once at startup and served from memory under a name
+that includes a hash of their content (app.css -> app.3f2a9c1e5b7d.css), so
+they can be cached for a year and any edit changes the URL. A gzip copy, and a
+brotli copy when the brotli package is installed, are made up front and
+chosen per request from Accept-Encoding.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+
+class Asset:
+    def __init__(self, name, data):
+        self.name = name
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if self.mimetype.startswith('text/') or self.mimetype.endswith('javascript'):
+            self.mimetype += '; charset=utf-8'
+        self.etag = hashlib.sha256(data).hexdigest()
+        stem, extension = os.path.splitext(name)
+        self.url_name = f"{stem}.{self.etag[:12]}{extension}"
+
+        # Preferred encoding first; only keep copies that are actually smaller
+        self.encodings = {}
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(data, quality=11)
+        self.encodings['gzip'] = gzip.compress(data, compresslevel=9, mtime=0)
+        self.encodings = {encoding: body for encoding, body in self.encodings.items()
+                          if len(body) < len(data)}
+        self.encodings['identity'] = data
+
+
+def load(directory=STATIC_DIR):
+    """Return {original name: Asset} for every file in directory."""
+    assets = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                assets[name] = Asset(name, f.read())
+    return assets
@@ -0,0 +1,291 @@
+"""
+Dynamic micro-batching in front of the segmentation model.
+
+Request threads preprocess their own image into a model tensor and queue it.
+A single scheduler thread per model collects queued tensors for up to
+BATCH_MAX_WAIT_MS milliseconds or BATCH_MAX_SIZE images, runs them through
+onnxruntime as one batch and resolves each request's future with its mask.
+When the model pool unloads a session its scheduler is stopped after draining
+the requests already queued. With an inference process pool (see
+inference_pool.py) batchable predictions are sent there instead.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from PIL import Image
+
+import config
+import metrics
+import sessions
+from sessions import base_model, get_session
+
+# Normalisation used by rembg for each batchable model: (mean, std, input size)
+_IMAGENET = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320))
+NORMALIZATION = {
+    'u2net': _IMAGENET,
+    'u2netp': _IMAGENET,
+    'u2net_human_seg': _IMAGENET,
+    'u2net_custom': _IMAGENET,
+    'silueta': _IMAGENET,
+    'isnet-general-use': ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+
+def normalization(model_name):
+    """(mean, std, input size) for a model, or None if it cannot be batched."""
+    return NORMALIZATION.get(base_model(model_name))
+
+
+def input_tensor(session, img):
+    """The normalised model input tensor for one image, as rembg's normalize() builds it."""
+    name = session.inner_session.get_inputs()[0].name
+    return session.normalize(img, *normalization(session.model_name))[name]
+
+
+def infer(session, tensors):
+    """Run model input tensors through a session as one batch and return the raw outputs."""
+    model_input = session.inner_session.get_inputs()[0]
+    run = session.inner_session.run
+    if isinstance(model_input.shape[0], int):
+        # Models exported with a fixed batch dimension get one run per image
+        return np.concatenate([run(None, {model_input.name: t})[0] for t in tensors])
+    return run(None, {model_input.name: np.concatenate(tensors)})[0]
+
+
+def batch_summary(sizes):
+    """Summary of achieved batch sizes given as {batch size: number of runs}."""
+    batches = sum(sizes.values())
+    images = sum(size * count for size, count in sizes.items())
+    return {
+        'batches': batches,
+        'images': images,
+        'mean_batch_size': round(images / batches, 2) if batches else 0.0,
+        'batch_sizes': {str(size): sizes[size] for size in sorted(sizes)},
+    }
+
+
+def prediction_to_mask(pred, size):
+    """Turn a raw (H, W) model output into an L mask of the given size."""
+    mi, ma = pred.min(), pred.max()
+    pred = (pred - mi) / max(ma - mi, 1e-6)
+    mask = Image.fromarray((pred.clip(0, 1) * 255).astype('uint8'), mode='L')
+    return mask.resize(size, Image.Resampling.LANCZOS)
+
+
+class SchedulerStopped(RuntimeError):
+    pass
+
+
+class BatchScheduler:
+    """Groups concurrent predictions for one session into batched runs."""
+
+    def __init__(self, session, max_batch_size, max_wait_ms):
+        self.session = session
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stopped = False
+        self._stop_lock = threading.Lock()
+        self._pending = 0
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = {}
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f'batcher-{session.model_name}')
+        self._thread.start()
+
+    def submit(self, img):
+        """Queue an image and return a future resolving to its raw prediction."""
+        return self._enqueue(input_tensor(self.session, img))
+
+    def _enqueue(self, tensor):
+        future = Future()
+        with self._stop_lock:
+            if self._stopped:
+                raise SchedulerStopped(f"Scheduler for '{self.session.model_name}' is stopped")
+            self._queue.put((tensor, future))
+        return future
+
+    def stop(self):
+        """Finish the queued requests, then let the scheduler thread exit."""
+        with self._stop_lock:
+            if not self._stopped:
+                self._stopped = True
+                self._queue.put(None)
+
+    def predict(self, img):
+        """Return the L mask for an image, blocking until its batch has run."""
+        with self._stats_lock:
+            self._pending += 1
+        try:
+            pred = self.submit(img).result()
+        finally:
+            with self._stats_lock:
+                self._pending -= 1
+        return prediction_to_mask(pred, img.size)
+
+    def predict_many(self, imgs):
+        """Return the L masks for several images, queued together so they share batches."""
+        with self._stats_lock:
+            self._pending += len(imgs)
+        try:
+            # Preprocess everything first so the images are queued back to back
+            tensors = [input_tensor(self.session, img) for img in imgs]
+            futures = [self._enqueue(tensor) for tensor in tensors]
+            preds = [future.result() for future in futures]
+        finally:
+            with self._stats_lock:
+                self._pending -= len(imgs)
+        return [prediction_to_mask(pred, img.size) for pred, img in zip(preds, imgs)]
+
+    def _collect(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Only wait for requests that are already being preprocessed;
+            # a lone request should not pay the batching window
+            if len(batch) >= self._pending and self._queue.empty():
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Stop marker: run what we have, exit on the next collect
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            futures = [future for _, future in batch]
+            try:
+                outputs = infer(self.session, [tensor for tensor, _ in batch])
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+            metrics.BATCH_SIZE.observe(len(batch), model=self.session.model_name)
+            for i, future in enumerate(futures):
+                future.set_result(outputs[i, 0])
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def batch_sizes(self):
+        with self._stats_lock:
+            return dict(self._batch_sizes)
+
+    def stats(self):
+        return {**batch_summary(self.batch_sizes()), 'queue_depth': self.queue_depth()}
+
+
+_schedulers = {}
+_lock = threading.Lock()
+
+
+def get_scheduler(model_name=None):
+    """Return the scheduler for a model, or None if it cannot be batched."""
+    if config.BATCH_MAX_SIZE <= 1:
+        return None
+    session = get_session(model_name)
+    if normalization(session.model_name) is None:
+        return None
+
+    scheduler = _schedulers.get(session.model_name)
+    if scheduler is None:
+        with _lock:
+            scheduler = _schedulers.get(session.model_name)
+            if scheduler is None:
+                scheduler = BatchScheduler(session, config.BATCH_MAX_SIZE,
+                                           config.BATCH_MAX_WAIT_MS)
+                _schedulers[session.model_name] = scheduler
+    return scheduler
+
+
+_pool = None
+
+
+def use_pool(pool):
+    """Send batchable predictions to an inference process pool (None to stop)."""
+    global _pool
+    _pool = pool
+
+
+def predict_mask(img, model_name=None):
+    """Predict the foreground mask for an image, batching when possible."""
+    pool = _pool
+    if pool is not None and pool.accepts([img], model_name):
+        return pool.predict_masks([img], model_name)[0]
+    scheduler = get_scheduler(model_name)
+    if scheduler is not None:
+        try:
+            return scheduler.predict(img)
+        except SchedulerStopped:
+            # The model was unloaded from the pool while this request started
+            pass
+    return get_session(model_name).predict(img)[0]
+
+
+def predict_masks(imgs, model_name=None):
+    """Predict the foreground masks for several images, batched together when possible."""
+    pool = _pool
+    if pool is not None and pool.accepts(imgs, model_name):
+        return pool.predict_masks(imgs, model_name)
+    scheduler = get_scheduler(model_name)
+    if scheduler is not None:
+        try:
+            return scheduler.predict_many(imgs)
+        except SchedulerStopped:
+            pass
+    session = get_session(model_name)
+    return [session.predict(img)[0] for img in imgs]
+
+
+def _drop_scheduler(session):
+    with _lock:
+        scheduler = _schedulers.get(session.model_name)
+        if scheduler is None or scheduler.session is not session:
+            return
+        del _schedulers[session.model_name]
+    scheduler.stop()
+
+
+sessions.on_evict(_drop_scheduler)
+
+
+def stats():
+    """Achieved batch sizes per model, in process and in the inference pool."""
+    schedulers = dict(_schedulers)
+    sizes = {name: scheduler.batch_sizes() for name, scheduler in schedulers.items()}
+    pool = _pool
+    if pool is not None:
+        # Images too large for a slot are still batched in process, so both are counted
+        for name, pool_sizes in pool.batch_sizes().items():
+            merged = sizes.setdefault(name, {})
+            for size, count in pool_sizes.items():
+                merged[size] = merged.get(size, 0) + count
+    return {name: {**batch_summary(model_sizes),
+                   'queue_depth': schedulers[name].queue_depth() if name in schedulers else 0}
+            for name, model_sizes in sizes.items()}
+
+
+metrics.Callback('batch_queue_depth', 'Images waiting for a batched model run.',
+                 lambda: {(name,): s.queue_depth() for name, s in list(_schedulers.items())},
+                 ['model'])
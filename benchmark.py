@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Latency benchmarks for the background removal pipeline.
+
+Usage:
+    python benchmark.py run [--models u2net u2netp] [--threads 1 4] [--sizes 1024 4096]
+                            [--images 2.png ...] [--repeat 5] [--output results.json]
+    python benchmark.py compare BASELINE.json CANDIDATE.json
+
+`run` times every pipeline stage separately (decode, preprocess, inference,
+postprocess, encode), the whole pipeline and a full HTTP round trip through
+the Flask app, for every combination of model, onnxruntime thread count and
+image size. Each (model, threads) combination runs in a fresh subprocess so
+sessions and thread pools never leak between configurations; it stores the
+app's results in a temporary directory removed when it finishes and writes
+its measurements to a file named by the parent, not to stdout. Results are
+written as JSON together with the library versions and commit they were
+measured on; `compare` prints the p50/p99 change between two result files.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SAMPLE_IMAGES = ['2.png', '2462095_edited.jpg', '5fa375512b459.jpeg']
+STAGES = ['decode', 'preprocess', 'inference', 'postprocess', 'encode',
+          'pipeline', 'http_overhead']
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+
+    def percentile(p):
+        index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+        return ordered[index] * 1000
+
+    return {
+        'p50': round(percentile(50), 3),
+        'p90': round(percentile(90), 3),
+        'p99': round(percentile(99), 3),
+        'mean': round(statistics.fmean(ordered) * 1000, 3),
+        'n': len(ordered),
+    }
+
+
+def resized_sample(path, long_side):
+    """Re-encode a sample image in its own format with the given longest side."""
+    from PIL import Image
+
+    img = Image.open(path)
+    fmt = img.format
+    scale = long_side / max(img.size)
+    img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                     Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    if fmt == 'JPEG':
+        img.convert('RGB').save(buffer, 'JPEG', quality=90)
+    else:
+        img.save(buffer, fmt)
+    return buffer.getvalue(), img.size
+
+
+def time_stages(data, model_name):
+    """Run the pipeline stage by stage, returning {stage: seconds}."""
+    from rembg.bg import fix_image_orientation, naive_cutout
+
+    import batching
+    import config
+    import encoding
+    import pipeline
+    from masks import upsample_mask
+    from sessions import get_session
+
+    session = get_session(model_name)
+    clock = time.perf_counter
+    timings = {}
+
+    start = clock()
+    full = pipeline._open(data)
+    if max(full.size) >= 2 * config.INFERENCE_MAX_SIDE:
+        img = fix_image_orientation(pipeline.downscaled(data, config.INFERENCE_MAX_SIDE))
+    else:
+        img = full = fix_image_orientation(full)
+    img.load()
+    if img is not full:
+        full = fix_image_orientation(full)
+    timings['decode'] = clock() - start
+
+    start = clock()
+    if batching.normalization(session.model_name) is not None:
+        inputs = session.normalize(img, *batching.normalization(session.model_name))
+        timings['preprocess'] = clock() - start
+
+        start = clock()
+        pred = session.inner_session.run(None, inputs)[0][0, 0]
+        timings['inference'] = clock() - start
+
+        start = clock()
+        mask = batching.prediction_to_mask(pred, img.size)
+    else:
+        # No batchable normalisation known: preprocessing happens inside predict()
+        timings['preprocess'] = 0.0
+        mask = session.predict(img)[0]
+        timings['inference'] = clock() - start
+        start = clock()
+    if img is not full:
+        mask = upsample_mask(mask, img.convert('L'), full.convert('L'))
+    cutout = naive_cutout(full, mask)
+    timings['postprocess'] = clock() - start
+
+    start = clock()
+    encoding.encode(cutout, 'png')
+    timings['encode'] = clock() - start
+    return timings
+
+
+def worker(args):
+    """Benchmark one (model, threads) configuration and write JSON results to args.output."""
+    os.environ['OMP_NUM_THREADS'] = str(args.threads)
+    import config
+    # Repeat uploads must not be served from the result cache
+    config.CACHE_MAX_ENTRIES = 0
+    config.BATCH_MAX_SIZE = 1
+    config.DEFAULT_MODEL = args.model
+    config.ORT_INTRA_OP_THREADS = args.threads
+
+    with tempfile.TemporaryDirectory() as result_dir:
+        config.RESULT_DIR = result_dir
+        results = _measure(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f)
+
+
+def _measure(args):
+    import app
+    from pipeline import remove_background
+
+    client = app.create_app().test_client()
+    results = []
+    for path in args.images:
+        for long_side in args.sizes:
+            data, size = resized_sample(path, long_side)
+            samples = {stage: [] for stage in STAGES}
+            for i in range(args.warmup + args.repeat):
+                timings = time_stages(data, args.model)
+
+                start = time.perf_counter()
+                remove_background(data, args.model)
+                timings['pipeline'] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                response = client.post('/', data={'image': (io.BytesIO(data), os.path.basename(path))},
+                                       content_type='multipart/form-data')
+                http = time.perf_counter() - start
+                if response.status_code != 200:
+                    raise RuntimeError(f"HTTP {response.status_code} for {path}")
+                timings['http_overhead'] = max(0.0, http - timings['pipeline'])
+
+                if i >= args.warmup:
+                    for stage in STAGES:
+                        samples[stage].append(timings[stage])
+
+            results.append({
+                'model': args.model,
+                'threads': args.threads,
+                'image': os.path.basename(path),
+                'size': list(size),
+                'bytes': len(data),
+                'stages': {stage: summarize(samples[stage]) for stage in STAGES},
+            })
+    return results
+
+
+def environment():
+    import numpy
+    import onnxruntime
+    import PIL
+    from importlib.metadata import version
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'rembg': version('rembg'),
+        'onnxruntime': onnxruntime.__version__,
+        'pillow': PIL.__version__,
+        'numpy': numpy.__version__,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def run(args):
+    results = []
+    for model_name in args.models:
+        for threads in args.threads:
+            print(f"⏱️  {model_name}, {threads} thread(s)...", file=sys.stderr)
+            with tempfile.TemporaryDirectory() as tmp:
+                output = os.path.join(tmp, 'results.json')
+                command = [sys.executable, os.path.abspath(__file__), '_worker',
+                           '--model', model_name, '--threads', str(threads),
+                           '--repeat', str(args.repeat), '--warmup', str(args.warmup),
+                           '--sizes', *map(str, args.sizes), '--images', *args.images,
+                           '--output', output]
+                # The app's progress prints are dropped; errors still reach stderr
+                subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+                with open(output) as f:
+                    results.extend(json.load(f))
+
+    report = {'environment': environment(), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+
+def compare(args):
+    def load(path):
+        with open(path) as f:
+            report = json.load(f)
+        return {(r['model'], r['threads'], r['image'], tuple(r['size'])): r['stages']
+                for r in report['results']}, report['environment']
+
+    base, base_env = load(args.baseline)
+    candidate, candidate_env = load(args.candidate)
+    print(f"baseline:  {base_env.get('commit')}  candidate: {candidate_env.get('commit')}")
+    print(f"{'model':<18}{'thr':>4} {'image':<22}{'size':>11}  {'stage':<14}"
+          f"{'p50 ms':>10}{'Δp50':>9}{'p99 ms':>10}{'Δp99':>9}")
+    for key in sorted(base.keys() & candidate.keys()):
+        model_name, threads, image, size = key
+        for stage in STAGES:
+            old, new = base[key].get(stage), candidate[key].get(stage)
+            if not old or not new:
+                continue
+
+            def change(metric):
+                return f"{(new[metric] - old[metric]) / old[metric] * 100:+.1f}%" if old[metric] else 'n/a'
+
+            print(f"{model_name:<18}{threads:>4} {image:<22}{'x'.join(map(str, size)):>11}  {stage:<14}"
+                  f"{new['p50']:>10.1f}{change('p50'):>9}{new['p99']:>10.1f}{change('p99'):>9}")
+
+    for key in sorted(base.keys() ^ candidate.keys()):
+        print(f"only in {'baseline' if key in base else 'candidate'}: {key}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the background removal pipeline.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--models', nargs='+', default=['u2net'])
+    run_parser.add_argument('--threads', nargs='+', type=int, default=[os.cpu_count() or 1])
+    run_parser.add_argument('--sizes', nargs='+', type=int, default=[512, 1024, 2048, 4096],
+                            help="longest image side in pixels")
+    run_parser.add_argument('--images', nargs='+', default=SAMPLE_IMAGES)
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--warmup', type=int, default=1)
+    run_parser.add_argument('--output', default='benchmark_results.json')
+
+    worker_parser = commands.add_parser('_worker')
+    worker_parser.add_argument('--model', required=True)
+    worker_parser.add_argument('--threads', type=int, required=True)
+    worker_parser.add_argument('--sizes', nargs='+', type=int, required=True)
+    worker_parser.add_argument('--images', nargs='+', required=True)
+    worker_parser.add_argument('--repeat', type=int, required=True)
+    worker_parser.add_argument('--warmup', type=int, required=True)
+    worker_parser.add_argument('--output', required=True)
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        args.images = [os.path.abspath(path) for path in args.images]
+        run(args)
+    elif args.command == '_worker':
+        worker(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
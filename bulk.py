@@ -0,0 +1,177 @@
+"""
+Bulk processing: many images (or a ZIP of images) in, a ZIP of cutouts out.
+
+Inputs are read lazily from Werkzeug's spooled upload files, processed on a
+shared thread pool (so they also share model runs through the micro-batching
+scheduler) and each cutout is written to the response ZIP as soon as it is done.
+Only a bounded window of images is in flight at any time, so neither the
+inputs nor the outputs are ever held in memory all at once.
+"""
+
+import json
+import os
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+
+from uploads import UploadError, read_upload, sniff_image_type
+
+_executor = None
+_executor_lock = threading.Lock()
+# Images submitted by all running archives and not finished yet
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+def get_executor(workers):
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk')
+    return _executor
+
+
+def in_flight():
+    """Number of images queued or running for bulk archives."""
+    with _in_flight_lock:
+        return _in_flight
+
+
+def _track(future):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+
+    def finished(_):
+        global _in_flight
+        with _in_flight_lock:
+            _in_flight -= 1
+
+    # Also runs when the future is cancelled
+    future.add_done_callback(finished)
+    return future
+
+
+class _ZipBuffer:
+    """Write-only sink that lets zipfile stream into a response generator."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _is_zip(stream):
+    head = stream.read(4)
+    stream.seek(0)
+    return head == b'PK\x03\x04'
+
+
+def _read_member(archive, info, lock, max_size):
+    if info.file_size > max_size:
+        raise UploadError(f"File too large. Maximum size is {max_size // (1024 * 1024)}MB", 413)
+    # ZipFile shares one file handle between members
+    with lock:
+        data = archive.read(info)
+    if sniff_image_type(data[:16]) is None:
+        raise UploadError("Unsupported file type", 415)
+    return data
+
+
+def iter_inputs(files, max_size):
+    """Yield (name, loader) pairs for uploaded images and ZIP archive members."""
+    for file in files:
+        if not _is_zip(file.stream):
+            yield file.filename, partial(read_upload, file, max_size)
+            continue
+
+        archive = zipfile.ZipFile(file.stream)
+        lock = threading.Lock()
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name or name.startswith('.') or '__MACOSX' in info.filename:
+                continue
+            yield info.filename, partial(_read_member, archive, info, lock, max_size)
+
+
+def _output_name(name, used, extension):
+    stem = os.path.splitext(os.path.basename(name))[0] or 'image'
+    candidate = f"{stem}{extension}"
+    counter = 1
+    while candidate in used:
+        counter += 1
+        candidate = f"{stem}_{counter}{extension}"
+    used.add(candidate)
+    return candidate
+
+
+def _process(loader, process):
+    return process(loader())
+
+
+def stream_zip(inputs, process, executor, window, max_files, extension='.png'):
+    """
+    Run process(data) -> image bytes for every input and yield the bytes of a
+    ZIP archive containing the results, in completion order. Failures are
+    listed in errors.json at the end of the archive instead of aborting it.
+    """
+    inputs = iter(inputs)
+    pending = {}
+    used_names = set()
+    errors = []
+    count = 0
+    buffer = _ZipBuffer()
+
+    def fill():
+        nonlocal count, inputs
+        while len(pending) < window:
+            try:
+                name, loader = next(inputs)
+            except StopIteration:
+                return
+            count += 1
+            if count > max_files:
+                errors.append({'file': name, 'error': f"Too many files (maximum {max_files}); the rest were skipped"})
+                inputs = iter(())
+                return
+            pending[_track(executor.submit(_process, loader, process))] = name
+
+    try:
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+            fill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    try:
+                        archive.writestr(_output_name(name, used_names, extension), future.result())
+                    except Exception as e:
+                        message = e.message if isinstance(e, UploadError) else str(e)
+                        errors.append({'file': name, 'error': message})
+                yield buffer.take()
+                fill()
+
+            if errors:
+                archive.writestr('errors.json', json.dumps(errors, indent=2))
+        yield buffer.take()
+    finally:
+        # Client went away: drop work that has not started yet
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,67 @@
+"""
+Content-addressed result cache.
+
+Maps the SHA-256 of an upload plus the model and post-processing options to
+the file id of a result that is already on disk, so repeat uploads of the
+same image skip inference entirely.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def cache_key(data, model_name, **options):
+    """Build a cache key from the raw upload bytes and processing parameters."""
+    digest = hashlib.sha256(data).hexdigest()
+    params = ','.join(f'{name}={options[name]}' for name in sorted(options))
+    return f'{digest}:{model_name}:{params}'
+
+
+class ResultCache:
+    """Thread-safe LRU mapping of cache keys to result file ids."""
+
+    def __init__(self, max_entries, exists=None):
+        self.max_entries = max_entries
+        self._exists = exists
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            file_id = self._entries.get(key)
+            if file_id is not None and self._exists is not None and not self._exists(file_id):
+                # The result file has been removed from disk behind our back
+                del self._entries[key]
+                file_id = None
+            if file_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return file_id
+
+    def put(self, key, file_id):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = file_id
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
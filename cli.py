@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Offline bulk background removal.
+
+Usage:
+    python cli.py INPUT_DIR OUTPUT_DIR [--workers N] [--threads N] [--model NAME]
+                  [--format png|webp|webp-lossy|avif]
+
+Walks INPUT_DIR recursively and writes a cutout (PNG by default) for every
+image to the same relative path under OUTPUT_DIR. Each worker process keeps its own warm
+model session with onnxruntime limited to --threads threads, so the pool does
+not oversubscribe the CPU.
+
+A manifest in OUTPUT_DIR records the hash of every processed input. Images
+whose output is newer than the input, or whose content hash is unchanged, are
+skipped, so an interrupted run resumes where it stopped.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import config
+import encoding
+from pipeline import remove_background
+from sessions import get_session
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.mp4'}
+MANIFEST_NAME = '.rembg-manifest.jsonl'
+
+
+def find_images(input_dir):
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, input_dir)
+
+
+def output_path(output_dir, rel_path, output_format='png'):
+    return os.path.join(output_dir, os.path.splitext(rel_path)[0] + encoding.extension(output_format))
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path):
+    """Return {relative path: entry}; later lines override earlier ones."""
+    manifest = {}
+    if not os.path.exists(path):
+        return manifest
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A run killed mid-write can leave a truncated last line
+                continue
+            manifest[entry['path']] = entry
+    return manifest
+
+
+def is_up_to_date(src, dst, entry, model_name):
+    if not os.path.exists(dst):
+        return False
+    if entry is not None and entry.get('model') != model_name:
+        return False
+    if os.path.getmtime(dst) >= os.path.getmtime(src):
+        return True
+    return entry is not None and entry.get('sha256') == file_hash(src)
+
+
+def init_worker(model_name, threads):
+    # onnxruntime threads come from config; OMP_NUM_THREADS caps other OpenMP users
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    config.ORT_INTRA_OP_THREADS = threads
+    config.DEFAULT_MODEL = model_name
+    # One image at a time per process: nothing to batch
+    config.BATCH_MAX_SIZE = 1
+    get_session(model_name)
+
+
+def process_file(src, dst, output_format, tiled=False):
+    with open(src, 'rb') as f:
+        data = f.read()
+    output = remove_background(data, output_format=output_format, tiled=tiled)
+
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    tmp_path = dst + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(output)
+    os.replace(tmp_path, dst)
+    return hashlib.sha256(data).hexdigest()
+
+
+def run(args):
+    manifest_path = os.path.join(args.output_dir, MANIFEST_NAME)
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest = load_manifest(manifest_path)
+
+    tasks = []
+    skipped = 0
+    for rel_path in find_images(args.input_dir):
+        src = os.path.join(args.input_dir, rel_path)
+        dst = output_path(args.output_dir, rel_path, args.format)
+        if not args.force and is_up_to_date(src, dst, manifest.get(rel_path), args.model):
+            skipped += 1
+            continue
+        tasks.append((rel_path, src, dst))
+
+    print(f"🗂️  {len(tasks)} images to process, {skipped} already up to date")
+    print(f"⚙️  {args.workers} worker processes x {args.threads} threads, model '{args.model}'")
+    if not tasks:
+        return 0
+
+    done = 0
+    failed = 0
+    start = time.perf_counter()
+    pending = {}
+    queue = iter(tasks)
+    # Spawn rather than fork: rembg pulls in numba/pymatting thread pools that
+    # leave forked children hanging at exit
+    executor = ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                                   initargs=(args.model, args.threads),
+                                   mp_context=multiprocessing.get_context('spawn'))
+    try:
+        with open(manifest_path, 'a') as manifest_file:
+            while True:
+                while len(pending) < args.workers * 4:
+                    task = next(queue, None)
+                    if task is None:
+                        break
+                    pending[executor.submit(process_file, task[1], task[2], args.format,
+                                            args.tiled)] = task
+                if not pending:
+                    break
+
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    rel_path, _, _ = pending.pop(future)
+                    try:
+                        digest = future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f"❌ {rel_path}: {e}")
+                        continue
+                    done += 1
+                    manifest_file.write(json.dumps({'path': rel_path, 'sha256': digest,
+                                                    'model': args.model}) + '\n')
+                    manifest_file.flush()
+
+                if done and done % 50 == 0:
+                    rate = done / (time.perf_counter() - start)
+                    print(f"🔄 {done}/{len(tasks)} done ({rate:.2f} images/sec)")
+    except KeyboardInterrupt:
+        print("\n⏹️  Interrupted; run again to resume")
+        executor.shutdown(wait=False, cancel_futures=True)
+        return 130
+    executor.shutdown()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Processed {done} images in {elapsed:.1f}s "
+          f"({done / elapsed:.2f} images/sec), {skipped} skipped, {failed} failed")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Remove backgrounds from every image in a directory.")
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes (default: one per 2 CPU cores)")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="onnxruntime threads per worker (default: cores / workers)")
+    parser.add_argument('--model', default=config.DEFAULT_MODEL)
+    parser.add_argument('--format', default='png', choices=encoding.available_formats())
+    parser.add_argument('--tiled', action='store_true',
+                        help="predict masks in full-resolution tiles (panoramas, very large photos)")
+    parser.add_argument('--force', action='store_true', help="reprocess up-to-date images too")
+    args = parser.parse_args(argv)
+
+    args.workers = args.workers or max(1, cpus // 2)
+    args.threads = args.threads or max(1, cpus // args.workers)
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Service configuration for the Background Remover.
+
+Every setting can be overridden with an environment variable of the same name.
+"""
+
+import os
+
+
+def _env_list(name, default=''):
+    value = os.environ.get(name, default)
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+# Model used when a request does not ask for a specific one
+DEFAULT_MODEL = os.environ.get('REMBG_MODEL', 'u2net')
+
+# onnxruntime execution providers, e.g. "CUDAExecutionProvider,CPUExecutionProvider".
+# Empty means let rembg pick based on the installed onnxruntime build.
+MODEL_PROVIDERS = _env_list('REMBG_PROVIDERS')
+
+# onnxruntime session settings, applied to every model session the service
+# creates. Thread counts are a number, 0 for onnxruntime's own default, or "auto":
+# the available cores are shared evenly between the WEB_CONCURRENCY worker
+# processes (gunicorn reads the same variable) so workers do not oversubscribe
+# the CPU. Graph optimization is one of disable, basic, extended or all;
+# execution mode is sequential or parallel (independent graph branches run
+# concurrently on the inter-op pool). Disabling the memory arena lowers idle
+# memory at some speed cost.
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+ORT_INTRA_OP_THREADS = os.environ.get('ORT_INTRA_OP_THREADS', 'auto')
+ORT_INTER_OP_THREADS = os.environ.get('ORT_INTER_OP_THREADS', 'auto')
+ORT_GRAPH_OPTIMIZATION = os.environ.get('ORT_GRAPH_OPTIMIZATION', 'all')
+ORT_EXECUTION_MODE = os.environ.get('ORT_EXECUTION_MODE', 'sequential')
+ORT_MEM_ARENA = os.environ.get('ORT_MEM_ARENA', '1').lower() not in ('0', 'false', 'no')
+
+# Models a request may select with the `model` parameter
+ALLOWED_MODELS = _env_list('ALLOWED_MODELS', 'u2net,u2netp,silueta,u2net_human_seg,'
+                           'isnet-general-use,birefnet-general,birefnet-general-lite')
+
+# Model pool: sessions load on first use and the least recently used ones are
+# unloaded once the loaded model files add up to more than this many bytes
+# (0 means no cap). Models in WARMUP_MODELS are loaded and run once at startup.
+MODEL_POOL_MAX_BYTES = int(os.environ.get('MODEL_POOL_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+WARMUP_MODELS = _env_list('WARMUP_MODELS')
+
+# Directory holding INT8 quantized models written by quantize.py, selectable as
+# "<model>-int8" (default: rembg's model directory, U2NET_HOME or ~/.u2net)
+QUANTIZED_MODEL_DIR = os.environ.get('QUANTIZED_MODEL_DIR', '')
+
+# Micro-batching: concurrent requests are grouped into one model run of up to
+# BATCH_MAX_SIZE images, waiting at most BATCH_MAX_WAIT_MS for the batch to fill.
+# Raising the wait trades tail latency for throughput; BATCH_MAX_SIZE=1 disables it.
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 10))
+
+# Async job API: size of the worker pool and how long (seconds) finished jobs
+# stay queryable
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 3600))
+
+# Admission control, per worker process: images processed at once, images that
+# may wait for a slot and the longest (ms) an interactive request waits before
+# it gets 503 with a Retry-After header. Jobs and bulk archives wait instead.
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get('ADMISSION_MAX_CONCURRENCY', BATCH_MAX_SIZE))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 16))
+ADMISSION_MAX_WAIT_MS = float(os.environ.get('ADMISSION_MAX_WAIT_MS', 30000))
+# Priority lanes: web uploads are interactive, jobs and bulk archives are bulk.
+# Waiting work is started in proportion to the lane weights, bulk work never
+# takes the last ADMISSION_INTERACTIVE_RESERVE slots, and while the interactive
+# p95 exceeds ADMISSION_INTERACTIVE_SLO_MS (0 disables) bulk gets half its share.
+ADMISSION_INTERACTIVE_WEIGHT = float(os.environ.get('ADMISSION_INTERACTIVE_WEIGHT', 4))
+ADMISSION_BULK_WEIGHT = float(os.environ.get('ADMISSION_BULK_WEIGHT', 1))
+ADMISSION_INTERACTIVE_RESERVE = int(os.environ.get('ADMISSION_INTERACTIVE_RESERVE',
+                                                   max(1, ADMISSION_MAX_CONCURRENCY // 4)))
+ADMISSION_INTERACTIVE_SLO_MS = float(os.environ.get('ADMISSION_INTERACTIVE_SLO_MS', 5000))
+# New jobs and bulk archives are refused while this many bulk images are queued
+# for a job worker or in flight in bulk archives.
+ADMISSION_BULK_MAX_QUEUE = int(os.environ.get('ADMISSION_BULK_MAX_QUEUE', ADMISSION_MAX_QUEUE * 4))
+
+# Result cache: number of (upload hash, model, options) entries kept in the LRU.
+# 0 disables caching.
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+
+# Result store: directory for processed images (default: a new temp directory),
+# seconds a result is kept after its last access, total size cap in bytes and
+# how often (seconds) the janitor thread enforces both
+RESULT_DIR = os.environ.get('RESULT_DIR', '')
+RESULT_TTL = int(os.environ.get('RESULT_TTL', 3600))
+RESULT_MAX_BYTES = int(os.environ.get('RESULT_MAX_BYTES', 1024 * 1024 * 1024))
+JANITOR_INTERVAL = float(os.environ.get('JANITOR_INTERVAL', 60))
+
+# Cache lifetime (seconds) sent with result images. Result URLs are never
+# reused for different content, so browsers and CDNs may keep them this long.
+RESULT_CACHE_MAX_AGE = int(os.environ.get('RESULT_CACHE_MAX_AGE', 365 * 24 * 3600))
+
+# Images at least twice this size on their longest side are decoded at reduced
+# scale for inference; the mask is upsampled back to full resolution afterwards
+INFERENCE_MAX_SIDE = int(os.environ.get('INFERENCE_MAX_SIDE', 1024))
+
+# Tiled inference (tiled=1 per request, or automatically for images whose
+# longest side reaches TILED_AUTO_SIDE or whose aspect ratio reaches
+# TILED_AUTO_ASPECT; 0 disables either): the full-resolution image is cut into
+# TILE_SIZE pixel tiles overlapping by TILE_OVERLAP pixels, so panoramas and
+# very large photos keep small objects and fine edges.
+TILE_SIZE = int(os.environ.get('TILE_SIZE', 1024))
+TILE_OVERLAP = int(os.environ.get('TILE_OVERLAP', 128))
+TILED_AUTO_SIDE = int(os.environ.get('TILED_AUTO_SIDE', 0))
+TILED_AUTO_ASPECT = float(os.environ.get('TILED_AUTO_ASPECT', 0))
+
+# Animations and clips (animated GIF, APNG, animated WebP, MP4): the most
+# frames accepted, the longest frame side (larger frames are downscaled), and
+# mask reuse: a frame whose 64x64 greyscale differs from the last predicted
+# frame by less than ANIMATION_REUSE_THRESHOLD levels on average reuses its
+# mask, for at most ANIMATION_KEYFRAME_INTERVAL frames in a row (0: no limit).
+ANIMATION_MAX_FRAMES = int(os.environ.get('ANIMATION_MAX_FRAMES', 300))
+ANIMATION_MAX_SIDE = int(os.environ.get('ANIMATION_MAX_SIDE', 640))
+ANIMATION_REUSE_THRESHOLD = float(os.environ.get('ANIMATION_REUSE_THRESHOLD', 2.0))
+ANIMATION_KEYFRAME_INTERVAL = int(os.environ.get('ANIMATION_KEYFRAME_INTERVAL', 12))
+
+# Inference process pool: with INFERENCE_PROCESSES > 0 each server process
+# starts that many processes that run the models, fed through
+# INFERENCE_SHM_SLOTS shared-memory slots of INFERENCE_SHM_SLOT_PIXELS pixels
+# each (4 bytes per pixel; the default fits any image that is not downscaled
+# for inference). 0 keeps inference on the request threads.
+INFERENCE_PROCESSES = int(os.environ.get('INFERENCE_PROCESSES', 0))
+INFERENCE_SHM_SLOTS = int(os.environ.get('INFERENCE_SHM_SLOTS', 8))
+INFERENCE_SHM_SLOT_PIXELS = int(os.environ.get('INFERENCE_SHM_SLOT_PIXELS', (2 * INFERENCE_MAX_SIDE) ** 2))
+
+# Alpha matting (opt-in per request with alpha_matting=1): time budget per
+# request in milliseconds, tile size in pixels and the most tiles the uncertain
+# edge band may cover. Past either limit the plain mask is used instead.
+MATTING_BUDGET_MS = float(os.environ.get('MATTING_BUDGET_MS', 2000))
+MATTING_TILE_SIZE = int(os.environ.get('MATTING_TILE_SIZE', 512))
+MATTING_MAX_TILES = int(os.environ.get('MATTING_MAX_TILES', 16))
+# Most uncertain pixels solved per request, and conjugate gradient iterations per tile
+MATTING_MAX_UNKNOWN_PIXELS = int(os.environ.get('MATTING_MAX_UNKNOWN_PIXELS', 250000))
+MATTING_MAX_ITERATIONS = int(os.environ.get('MATTING_MAX_ITERATIONS', 2000))
+
+# Pixels of padding kept around the subject when a request asks for crop=1
+CROP_PADDING = int(os.environ.get('CROP_PADDING', 16))
+
+# Output encoding. OUTPUT_FORMAT (png, webp, webp-lossy or avif) is used unless
+# the request names a format, or explicitly accepts one of ACCEPT_FORMATS in its
+# Accept header. PNG_COMPRESS_LEVEL is zlib's 0-9 (lower encodes faster into
+# larger files); PNG_OPTIMIZE=1 spends extra time on a smaller file.
+# WEBP_LOSSLESS_METHOD 0 encodes faster than PNG; 1-6 give files about a third
+# smaller at several times the encode time. WEBP_QUALITY/WEBP_METHOD and the
+# AVIF settings apply to the lossy formats.
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'png')
+ACCEPT_FORMATS = _env_list('ACCEPT_FORMATS', 'webp')
+PNG_COMPRESS_LEVEL = int(os.environ.get('PNG_COMPRESS_LEVEL', 6))
+PNG_OPTIMIZE = os.environ.get('PNG_OPTIMIZE', '0').lower() not in ('0', 'false', 'no')
+WEBP_LOSSLESS_METHOD = int(os.environ.get('WEBP_LOSSLESS_METHOD', 0))
+WEBP_QUALITY = int(os.environ.get('WEBP_QUALITY', 80))
+WEBP_METHOD = int(os.environ.get('WEBP_METHOD', 4))
+AVIF_QUALITY = int(os.environ.get('AVIF_QUALITY', 75))
+AVIF_SPEED = int(os.environ.get('AVIF_SPEED', 6))
+
+# Bulk endpoint (POST /api/batch): worker threads, maximum images per request
+# and maximum request body size
+BULK_WORKERS = int(os.environ.get('BULK_WORKERS', os.cpu_count() or 2))
+BULK_MAX_FILES = int(os.environ.get('BULK_MAX_FILES', 1000))
+BULK_MAX_CONTENT_LENGTH = int(os.environ.get('BULK_MAX_CONTENT_LENGTH', 1024 * 1024 * 1024))
@@ -0,0 +1,83 @@
+"""
+Output encodings for cutouts.
+
+PNG stays the default, with zlib level and optimize configurable. Lossless
+WebP is typically a third smaller than PNG for the same pixels, and lossy WebP
+(with a separately compressed alpha plane) an order of magnitude smaller. AVIF
+is offered when the installed Pillow can write it (Pillow >= 11.2, or the
+pillow-avif-plugin package).
+"""
+
+import io
+
+from PIL import Image
+
+import config
+
+try:
+    import pillow_avif  # noqa: F401  (registers AVIF with older Pillow)
+except ImportError:
+    pass
+
+# name: (Pillow format, mimetype, file extension)
+FORMATS = {
+    'png': ('PNG', 'image/png', '.png'),
+    'webp': ('WEBP', 'image/webp', '.webp'),
+    'webp-lossy': ('WEBP', 'image/webp', '.webp'),
+    'avif': ('AVIF', 'image/avif', '.avif'),
+}
+MIMETYPES = {extension: mimetype for _, mimetype, extension in FORMATS.values()}
+
+
+def available_formats():
+    # Pillow registers its format plugins lazily
+    Image.init()
+    return [name for name, (pil_format, _, _) in FORMATS.items() if pil_format in Image.SAVE]
+
+
+def _save_options(name):
+    if name == 'png':
+        return {'compress_level': config.PNG_COMPRESS_LEVEL, 'optimize': config.PNG_OPTIMIZE}
+    if name == 'webp':
+        # exact=False lets the encoder rewrite the colour of fully transparent pixels
+        return {'lossless': True, 'method': config.WEBP_LOSSLESS_METHOD, 'exact': False}
+    if name == 'webp-lossy':
+        return {'quality': config.WEBP_QUALITY, 'method': config.WEBP_METHOD}
+    return {'quality': config.AVIF_QUALITY, 'speed': config.AVIF_SPEED}
+
+
+def encode(img, name='png'):
+    """Encode an image in one of the FORMATS and return the bytes."""
+    output = io.BytesIO()
+    img.save(output, FORMATS[name][0], **_save_options(name))
+    return output.getvalue()
+
+
+def encode_animation(frames, durations, loop=0, name='png'):
+    """Encode frames as an animation (APNG, animated WebP or AVIF) and return the bytes."""
+    output = io.BytesIO()
+    frames[0].save(output, FORMATS[name][0], save_all=True, append_images=frames[1:],
+                   duration=durations, loop=loop, **_save_options(name))
+    return output.getvalue()
+
+
+def extension(name):
+    return FORMATS[name][2]
+
+
+def mimetype(name):
+    return FORMATS[name][1]
+
+
+def negotiate(accept):
+    """Pick an output format from a Werkzeug Accept header.
+
+    Only formats in ACCEPT_FORMATS that the client lists explicitly are
+    considered, so clients sending */* keep getting OUTPUT_FORMAT.
+    """
+    listed = {value for value, quality in accept if quality > 0}
+    available = available_formats()
+    for name in config.ACCEPT_FORMATS:
+        if name in available and FORMATS[name][1] in listed:
+            return name
+    return config.OUTPUT_FORMAT
@@ -0,0 +1,58 @@
+"""
+gunicorn settings for the Background Remover.
+
+Run with: gunicorn -c gunicorn.conf.py wsgi:app
+
+Inference is CPU-bound, so the defaults favour a few worker processes, each
+running onnxruntime on its share of the cores, over one worker per core: a
+320x320 U2-Net run stops getting faster at around four intra-op threads.
+Each worker serves several requests at once on threads, which is what lets
+the micro-batcher group concurrent requests into one model run.
+
+The app is preloaded in the master so imported libraries and the downloaded
+model files are shared copy-on-write; model sessions are created after fork
+(see app.preload). On SIGTERM each worker stops taking jobs and drains the
+queued ones within graceful_timeout.
+
+Every value can be overridden with the environment variable named below or on
+the gunicorn command line.
+"""
+
+import os
+
+# Read before anything imports config, which picks up WEB_CONCURRENCY
+if hasattr(os, 'sched_getaffinity'):
+    cpus = len(os.sched_getaffinity(0))
+else:
+    cpus = os.cpu_count() or 1
+# Exported so the onnxruntime "auto" thread setting splits the cores the same way
+os.environ.setdefault('WEB_CONCURRENCY', str(max(1, cpus // 4)))
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ['WEB_CONCURRENCY'])
+worker_class = 'gthread'
+# Concurrent requests per worker; enough to fill a full micro-batch
+threads = int(os.environ.get('GUNICORN_THREADS', os.environ.get('BATCH_MAX_SIZE', 8)))
+# A large image with alpha matting can take tens of seconds on a busy worker
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 120))
+keepalive = 5
+preload_app = True
+# Recycling workers would throw away their warm model sessions
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+
+def on_starting(server):
+    import app
+    app.preload()
+
+
+def post_worker_init(worker):
+    import app
+    app.start_worker()
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown()
@@ -0,0 +1,317 @@
+"""
+Inference process pool fed through shared memory.
+
+With INFERENCE_PROCESSES > 0 each server process starts that many inference
+processes and hands them images through one multiprocessing.shared_memory
+segment cut into INFERENCE_SHM_SLOTS fixed-size slots. A request thread takes
+a free slot, writes the decoded RGB pixels into it and queues a few integers
+(request id, slot, model, size); the inference process resizes and normalises
+a zero-copy NumPy view of the slot, runs the model, and writes the 8-bit mask
+back into the same slot. Resizing goes through Pillow exactly as on the
+in-process path, so masks do not depend on INFERENCE_PROCESSES. No pixels are
+pickled in either direction, and the model runs outside the server process's
+GIL, so request threads stay responsive while a batch is being computed.
+
+Free slots form the ring the request threads cycle through. A caller takes
+the slots for a group of images all at once (at most BATCH_MAX_SIZE, and never
+more than exist) and waits while too few are free, which bounds the memory in
+flight without callers deadlocking on partly taken slots. Requests queued at
+the same time for the same model are run as one batch.
+
+The inference processes are started with the spawn method rather than
+forked: a server process that has imported pymatting runs numba's TBB thread
+pool, and forking it leaves the parent hanging at exit. A fresh interpreter
+inherits no onnxruntime state either, so processes can be replaced when one
+dies. Spawned processes re-import the main module (app.py under the
+development server), so it must not do work at import time; app.py keeps its
+setup in create_app() and its server start under a __main__ guard. Models
+that cannot be batched, and images larger than a slot, stay on the
+in-process path.
+"""
+
+import itertools
+import multiprocessing
+import queue
+import signal
+import threading
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+from PIL import Image
+
+import batching
+import config
+import metrics
+import sessions
+from batching import infer, input_tensor, normalization, prediction_to_mask
+
+# Longest (seconds) the result reader and the process watcher block before
+# looking at the current queues and processes again
+_POLL_INTERVAL = 1.0
+
+
+def _pixels(buffer, slot, slot_pixels, height, width):
+    offset = slot * slot_pixels * 4
+    return np.ndarray((height, width, 3), np.uint8, buffer=buffer, offset=offset)
+
+
+def _mask(buffer, slot, slot_pixels, height, width):
+    # The mask follows the slot's RGB area
+    offset = slot * slot_pixels * 4 + slot_pixels * 3
+    return np.ndarray((height, width), np.uint8, buffer=buffer, offset=offset)
+
+
+def _run_batch(shm, slot_pixels, model_name, batch):
+    # The same preprocessing, model run and mask conversion as the in-process scheduler
+    session = sessions.get_session(model_name)
+    tensors = [input_tensor(session, Image.fromarray(_pixels(shm.buf, slot, slot_pixels, height, width)))
+               for _, slot, _, height, width in batch]
+    outputs = infer(session, tensors)
+    for (_, slot, _, height, width), pred in zip(batch, outputs[:, 0]):
+        _mask(shm.buf, slot, slot_pixels, height, width)[...] = prediction_to_mask(pred, (width, height))
+
+
+def _serve(shm_name, slot_pixels, requests, results, threads):
+    """Inference process: run queued requests, grouped per model, until a None arrives."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    config.ORT_INTRA_OP_THREADS = threads
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    stopping = False
+    while not stopping:
+        message = requests.get()
+        if message is None:
+            return
+        batch = [message]
+        while len(batch) < max(1, config.BATCH_MAX_SIZE):
+            try:
+                message = requests.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:
+                # Finish what was taken, then exit
+                stopping = True
+                break
+            batch.append(message)
+
+        by_model = {}
+        for message in batch:
+            by_model.setdefault(message[2], []).append(message)
+        for model_name, group in by_model.items():
+            try:
+                _run_batch(shm, slot_pixels, model_name, group)
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            # One message per run, so the server process can record the batch size
+            results.put((model_name, [request_id for request_id, *_ in group], error))
+
+
+class InferencePool:
+    def __init__(self, processes, slots, slot_pixels):
+        self._context = multiprocessing.get_context('spawn')
+        self.slot_pixels = slot_pixels
+        self.slots = slots
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * slot_pixels * 4)
+        self._free = deque(range(slots))
+        self._slot_freed = threading.Condition()
+        self._requests = self._context.Queue()
+        self._results = self._context.Queue()
+        self._ids = itertools.count()
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._restarts = 0
+        # {model name: {batch size: number of runs}}
+        self._batch_sizes = {}
+        # Split this process's onnxruntime threads between the inference processes; with 0
+        # (onnxruntime's default) each would use every core, so the cores are split instead
+        threads = sessions.runtime_settings()['intra_op_threads'] or sessions.available_cpus()
+        self._threads = max(1, threads // processes)
+        self._processes = [self._start_process(i) for i in range(processes)]
+        self._reader = threading.Thread(target=self._read_results, daemon=True, name='inference-results')
+        self._reader.start()
+        # Liveness is watched on its own thread, so a dead process is noticed under steady result traffic too
+        self._watcher = threading.Thread(target=self._watch_processes, daemon=True, name='inference-watcher')
+        self._watcher.start()
+
+    def _start_process(self, index):
+        process = self._context.Process(target=_serve, name=f'inference-{index}', daemon=True,
+                                        args=(self._shm.name, self.slot_pixels, self._requests, self._results,
+                                              self._threads))
+        process.start()
+        return process
+
+    def accepts(self, imgs, model_name=None):
+        """Whether these images can go through the pool."""
+        if self._closed or normalization(model_name or config.DEFAULT_MODEL) is None:
+            return False
+        return all(img.width * img.height <= self.slot_pixels for img in imgs)
+
+    def _take(self, count):
+        with self._slot_freed:
+            while len(self._free) < count:
+                self._slot_freed.wait()
+            return [self._free.popleft() for _ in range(count)]
+
+    def _give(self, slots):
+        with self._slot_freed:
+            self._free.extend(slots)
+            self._slot_freed.notify_all()
+
+    def predict_masks(self, imgs, model_name=None):
+        """Return the L masks for several images, computed by the inference processes."""
+        model_name = model_name or config.DEFAULT_MODEL
+        group = max(1, min(config.BATCH_MAX_SIZE, self.slots))
+        masks = []
+        for start in range(0, len(imgs), group):
+            masks.extend(self._predict_group(imgs[start:start + group], model_name))
+        return masks
+
+    def _predict_group(self, imgs, model_name):
+        taken = self._take(len(imgs))
+        try:
+            futures = []
+            for img, slot in zip(imgs, taken):
+                rgb = img if img.mode == 'RGB' else img.convert('RGB')
+                _pixels(self._shm.buf, slot, self.slot_pixels, img.height, img.width)[...] = np.asarray(rgb)
+                future = Future()
+                request_id = next(self._ids)
+                with self._lock:
+                    self._futures[request_id] = future
+                    self._requests.put((request_id, slot, model_name, img.height, img.width))
+                futures.append(future)
+
+            masks = []
+            for future, slot, img in zip(futures, taken, imgs):
+                future.result()
+                # Copy the mask out before the slot is handed to another request
+                masks.append(Image.fromarray(_mask(self._shm.buf, slot, self.slot_pixels,
+                                                   img.height, img.width).copy(), mode='L'))
+            return masks
+        finally:
+            self._give(taken)
+
+    def _read_results(self):
+        while True:
+            try:
+                # The queue is replaced when processes are restarted, so it is looked up each time
+                message = self._results.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if message is None:
+                return
+            model_name, request_ids, error = message
+            with self._lock:
+                # Requests failed after a crash may still be answered late
+                futures = [self._futures.pop(request_id, None) for request_id in request_ids]
+                if error is None:
+                    sizes = self._batch_sizes.setdefault(model_name, {})
+                    sizes[len(request_ids)] = sizes.get(len(request_ids), 0) + 1
+            if error is None:
+                metrics.BATCH_SIZE.observe(len(request_ids), model=model_name)
+            for future in futures:
+                if future is None:
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(RuntimeError(error))
+
+    def _watch_processes(self):
+        while not self._closed:
+            # Returns as soon as a process exits
+            wait([process.sentinel for process in self._processes], timeout=_POLL_INTERVAL)
+            if not self._closed:
+                self._check_processes()
+
+    def _check_processes(self):
+        dead = [process for process in self._processes if not process.is_alive()]
+        if not dead:
+            return
+        for process in dead:
+            print(f"❌ Inference process {process.name} exited with code {process.exitcode}, restarting")
+
+        # A process killed while holding a queue's lock leaves the queue unusable,
+        # so all processes are replaced along with both queues
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        with self._lock:
+            futures, self._futures = self._futures, {}
+            self._requests = self._context.Queue()
+            self._results = self._context.Queue()
+        # Which requests the dead process held is unknown, so fail everything in flight
+        for future in futures.values():
+            future.set_exception(RuntimeError("Inference process exited"))
+        self._processes = [self._start_process(i) for i in range(len(self._processes))]
+        self._restarts += 1
+
+    def close(self, timeout=30):
+        """Let the inference processes finish queued requests, then release the segment."""
+        self._closed = True
+        self._watcher.join(timeout)
+        for _ in self._processes:
+            self._requests.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+        self._reader.join(timeout)
+        self._shm.close()
+        self._shm.unlink()
+
+    def batch_sizes(self):
+        """Achieved batch sizes of the inference processes, {model name: {batch size: runs}}."""
+        with self._lock:
+            return {name: dict(sizes) for name, sizes in self._batch_sizes.items()}
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._futures)
+        return {
+            'processes': sum(process.is_alive() for process in self._processes),
+            'restarts': self._restarts,
+            'threads_per_process': self._threads,
+            'slots': self.slots,
+            'free_slots': len(self._free),
+            'slot_bytes': self.slot_pixels * 4,
+            'in_flight': in_flight,
+        }
+
+
+_pool = None
+
+metrics.Callback('inference_pool_free_slots', 'Free shared-memory slots of the inference pool.',
+                 lambda: {(): _pool.stats()['free_slots']} if _pool is not None else {})
+
+
+def start():
+    """Fork the configured inference processes and route batchable predictions to them."""
+    global _pool
+    if config.INFERENCE_PROCESSES <= 0 or _pool is not None:
+        return None
+    _pool = InferencePool(config.INFERENCE_PROCESSES, config.INFERENCE_SHM_SLOTS,
+                          config.INFERENCE_SHM_SLOT_PIXELS)
+    batching.use_pool(_pool)
+    print(f"⚙️  Inference pool: {config.INFERENCE_PROCESSES} processes, "
+          f"{config.INFERENCE_SHM_SLOTS} shared-memory slots of {_pool.slot_pixels * 4 / 2**20:.0f} MB")
+    return _pool
+
+
+def stop():
+    global _pool
+    if _pool is None:
+        return
+    batching.use_pool(None)
+    _pool.close()
+    _pool = None
+
+
+def stats():
+    return _pool.stats() if _pool is not None else None
@@ -0,0 +1,195 @@
+"""
+Asynchronous background-removal jobs.
+
+Uploads submitted through the JSON API are processed on a bounded worker pool
+so the HTTP worker can answer straight away; clients poll the job status and
+fetch the result from the regular /result and /download routes once done.
+At most max_queued jobs may wait for a worker; further submissions are
+refused with JobsFull, so the backlog (and the drain at shutdown) stays bounded.
+
+With several server processes a poll can land on a process other than the one
+running the job, so when a state directory is given every status change is
+also written there as <job id>.json and unknown ids are looked up on disk.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_JOB_ID = re.compile(r'^[0-9a-f-]{36}$')
+# How often (seconds) the state directory is swept for jobs of other processes
+_STATE_SWEEP_INTERVAL = 60
+
+
+class JobsClosed(RuntimeError):
+    pass
+
+
+class JobsFull(RuntimeError):
+    pass
+
+
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = QUEUED
+        self.error = None
+        self.result_id = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'result_id': self.result_id,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        job = cls(state['id'])
+        for name in ('status', 'error', 'result_id', 'created_at', 'started_at', 'finished_at'):
+            setattr(job, name, state[name])
+        return job
+
+
+class JobManager:
+    """Runs process(data, **options) for each submitted upload on a thread pool.
+
+    process returns the file id under which the result was stored.
+    """
+
+    def __init__(self, process, max_workers, retention, state_dir=None, max_queued=None):
+        self._process = process
+        self._retention = retention
+        self._max_queued = max_queued
+        self._queued = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._state_dir = state_dir
+        self._last_sweep = time.time()
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+
+    def submit(self, data, **options):
+        job = Job(str(uuid.uuid4()))
+        with self._lock:
+            if self._closed:
+                raise JobsClosed("The server is shutting down")
+            if self._max_queued is not None and self._queued >= self._max_queued:
+                raise JobsFull("Too many jobs are waiting, please try again shortly")
+            self._prune()
+            self._jobs[job.id] = job
+            self._queued += 1
+        self._save(job)
+        self._executor.submit(self._run, job, data, options)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            job = self._load(job_id)
+        return job
+
+    def queued(self):
+        with self._lock:
+            return self._queued
+
+    def counts(self):
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs; with wait, block until queued and running ones finish."""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job, data, options):
+        with self._lock:
+            self._queued -= 1
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._save(job)
+        try:
+            job.result_id = self._process(data, **options)
+            job.status = DONE
+        except Exception as e:
+            print(f"❌ Job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+
+    def _state_path(self, job_id):
+        return os.path.join(self._state_dir, job_id + '.json')
+
+    def _save(self, job):
+        if self._state_dir is None:
+            return
+        path = self._state_path(job.id)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(job.to_dict(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"❌ Could not save job {job.id}: {e}")
+
+    def _load(self, job_id):
+        if self._state_dir is None or not _JOB_ID.match(job_id):
+            return None
+        try:
+            with open(self._state_path(job_id)) as f:
+                return Job.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _remove_state(self, job_id):
+        try:
+            os.remove(self._state_path(job_id))
+        except OSError:
+            pass
+
+    def _prune(self):
+        # Forget finished jobs once their retention period has passed
+        cutoff = time.time() - self._retention
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+            if self._state_dir is not None:
+                self._remove_state(job_id)
+
+        # Jobs left behind by processes that have since exited
+        if self._state_dir is not None and time.time() - self._last_sweep > _STATE_SWEEP_INTERVAL:
+            self._last_sweep = time.time()
+            with os.scandir(self._state_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
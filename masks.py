@@ -0,0 +1,68 @@
+"""
+Mask helpers for the background removal pipeline.
+"""
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Rows of the full-resolution mask produced per step when upsampling,
+# which keeps the float working set small for very large photos
+_STRIP_ROWS = 256
+# Mask levels up to this are background when cropping (faint prediction noise,
+# resampling ringing), the same threshold the matting trimap uses
+_CROP_THRESHOLD = 10
+
+
+def _box(img, radius):
+    return cv2.boxFilter(img, -1, (2 * radius + 1, 2 * radius + 1))
+
+
+def upsample_mask(mask, guide, full_guide, radius=4, eps=1e-3):
+    """
+    Upsample a low-resolution mask to the size of full_guide.
+
+    Uses the fast guided filter: the linear coefficients that map the guide to
+    the mask are fitted on the low-resolution pair (mask, guide), bilinearly
+    upsampled and applied to the full-resolution guide, so mask edges snap to
+    edges in the full-size photo. mask, guide and full_guide are L images.
+    """
+    p = np.asarray(mask, dtype=np.float32) / 255.0
+    i = np.asarray(guide, dtype=np.float32) / 255.0
+
+    mean_i = _box(i, radius)
+    mean_p = _box(p, radius)
+    var_i = _box(i * i, radius) - mean_i * mean_i
+    cov_ip = _box(i * p, radius) - mean_i * mean_p
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    mean_a = _box(a, radius)
+    mean_b = _box(b, radius)
+
+    full = np.asarray(full_guide)
+    height, width = full.shape
+    small_height, small_width = p.shape
+    out = np.empty((height, width), dtype=np.uint8)
+
+    # Same pixel-centre mapping as cv2.resize with INTER_LINEAR
+    map_x = ((np.arange(width, dtype=np.float32) + 0.5) * (small_width / width) - 0.5)
+    for top in range(0, height, _STRIP_ROWS):
+        bottom = min(top + _STRIP_ROWS, height)
+        ys = (np.arange(top, bottom, dtype=np.float32) + 0.5) * (small_height / height) - 0.5
+        grid_x, grid_y = np.meshgrid(map_x, ys)
+        strip_a = cv2.remap(mean_a, grid_x, grid_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        strip_b = cv2.remap(mean_b, grid_x, grid_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        q = strip_a * (full[top:bottom] / np.float32(255.0)) + strip_b
+        out[top:bottom] = np.clip(q * 255.0 + 0.5, 0, 255).astype(np.uint8)
+
+    return Image.fromarray(out, mode='L')
+
+
+def crop_box(mask, padding):
+    """Bounding box of the mask's foreground (above _CROP_THRESHOLD) grown by padding, or None if empty."""
+    box = mask.point(lambda v: 255 if v > _CROP_THRESHOLD else 0).getbbox()
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    return (max(0, left - padding), max(0, top - padding),
+            min(mask.width, right + padding), min(mask.height, bottom + padding))
@@ -0,0 +1,159 @@
+"""
+Budgeted alpha matting.
+
+rembg's alpha_matting_cutout() solves closed-form matting for every pixel of
+the image, which takes minutes on a large photo. Only the uncertain band of
+the trimap (the pixels between the eroded foreground and background) actually
+changes, so here the band's bounding box is cut into tiles, tiles without
+uncertain pixels are skipped and each remaining tile is solved with a small
+margin of context around it.
+
+Refinement is all-or-nothing: if the band needs more than MATTING_MAX_TILES
+tiles or has more than MATTING_MAX_UNKNOWN_PIXELS uncertain pixels, if a tile
+cannot be solved, or if the per-request time budget runs out, the caller gets
+None and falls back to the plain mask, so a request never returns a
+half-refined edge. The budget is enforced inside the conjugate gradient solve
+as well, which is stopped at the deadline.
+"""
+
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+from pymatting import estimate_alpha_cf, estimate_foreground_ml
+
+import config
+import metrics
+
+MATTING_RESULTS = metrics.Counter('matting_results_total', 'Alpha matting attempts by outcome.',
+                                  ['outcome'])
+
+# Context around each tile so the solve sees the surrounding known pixels
+_MARGIN = 16
+
+
+class _BudgetExceeded(Exception):
+    pass
+
+
+def trimap(mask, foreground_threshold, background_threshold, erode_size):
+    """255 for sure foreground, 0 for sure background, 128 for the uncertain band."""
+    kernel = np.ones((erode_size, erode_size), np.uint8) if erode_size > 0 else None
+    is_foreground = (mask > foreground_threshold).astype(np.uint8)
+    is_background = (mask < background_threshold).astype(np.uint8)
+    if kernel is not None:
+        is_foreground = cv2.erode(is_foreground, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+        is_background = cv2.erode(is_background, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=1)
+
+    result = np.full(mask.shape, 128, dtype=np.uint8)
+    result[is_foreground.astype(bool)] = 255
+    result[is_background.astype(bool)] = 0
+    return result
+
+
+def _tiles(unknown, tile_size):
+    """Crop boxes (with margin) and inner boxes of the tiles covering the band."""
+    rows = np.flatnonzero(unknown.any(axis=1))
+    cols = np.flatnonzero(unknown.any(axis=0))
+    if not len(rows):
+        return []
+    height, width = unknown.shape
+
+    tiles = []
+    for y0 in range(rows[0], rows[-1] + 1, tile_size):
+        for x0 in range(cols[0], cols[-1] + 1, tile_size):
+            y1 = min(y0 + tile_size, rows[-1] + 1)
+            x1 = min(x0 + tile_size, cols[-1] + 1)
+            if not unknown[y0:y1, x0:x1].any():
+                continue
+            crop = (max(0, y0 - _MARGIN), max(0, x0 - _MARGIN),
+                    min(height, y1 + _MARGIN), min(width, x1 + _MARGIN))
+            tiles.append((crop, (y0, x0, y1, x1)))
+    return tiles
+
+
+def _solve(image, tri, deadline=None):
+    """Alpha and foreground colours for one crop, or None if it cannot be solved.
+
+    Raises _BudgetExceeded once the monotonic deadline passes.
+    """
+    # Closed-form matting needs known pixels of both kinds to anchor the solve
+    if not (tri == 255).any() or not (tri == 0).any():
+        return None
+
+    def check_deadline(*args):
+        if deadline is not None and time.monotonic() > deadline:
+            raise _BudgetExceeded()
+
+    image = image / 255.0
+    alpha = estimate_alpha_cf(image, tri / 255.0,
+                              cg_kwargs={'maxiter': config.MATTING_MAX_ITERATIONS, 'callback': check_deadline})
+    check_deadline()
+    foreground = estimate_foreground_ml(image, alpha)
+    check_deadline()
+    return alpha, foreground
+
+
+def matting_cutout(img, mask, budget, foreground_threshold=240, background_threshold=10,
+                   erode_size=10):
+    """Cut out img with an alpha-matted edge, or return None to use the plain mask.
+
+    budget is the time in seconds the refinement may take.
+    """
+    deadline = time.monotonic() + budget
+    image = np.asarray(img.convert('RGB'))
+    mask = np.asarray(mask)
+    tri = trimap(mask, foreground_threshold, background_threshold, erode_size)
+
+    unknown = tri == 128
+    tiles = _tiles(unknown, config.MATTING_TILE_SIZE)
+    if not tiles:
+        MATTING_RESULTS.inc(outcome='no_band')
+        return None
+    if len(tiles) > config.MATTING_MAX_TILES or np.count_nonzero(unknown) > config.MATTING_MAX_UNKNOWN_PIXELS:
+        MATTING_RESULTS.inc(outcome='too_large')
+        return None
+
+    rgba = np.dstack([image, mask])
+    start = time.monotonic()
+    for done, (crop, inner) in enumerate(tiles):
+        # Give up as soon as the remaining tiles cannot finish in time
+        if done:
+            per_tile = (time.monotonic() - start) / done
+            if time.monotonic() + per_tile * (len(tiles) - done) > deadline:
+                MATTING_RESULTS.inc(outcome='budget_exceeded')
+                return None
+
+        cy0, cx0, cy1, cx1 = crop
+        try:
+            solved = _solve(image[cy0:cy1, cx0:cx1], tri[cy0:cy1, cx0:cx1], deadline)
+        except _BudgetExceeded:
+            MATTING_RESULTS.inc(outcome='budget_exceeded')
+            return None
+        except ValueError:
+            solved = None
+        if solved is None:
+            # Leaving this tile unrefined would give a half-refined edge
+            MATTING_RESULTS.inc(outcome='unsolvable')
+            return None
+
+        alpha, foreground = solved
+        y0, x0, y1, x1 = inner
+        inner_slice = np.s_[y0 - cy0:y1 - cy0, x0 - cx0:x1 - cx0]
+        rgba[y0:y1, x0:x1, :3] = np.clip(foreground[inner_slice] * 255, 0, 255)
+        rgba[y0:y1, x0:x1, 3] = np.clip(alpha[inner_slice] * 255, 0, 255)
+
+    if time.monotonic() > deadline:
+        MATTING_RESULTS.inc(outcome='budget_exceeded')
+        return None
+    MATTING_RESULTS.inc(outcome='refined')
+    return Image.fromarray(rgba, 'RGBA')
+
+
+def warmup():
+    """Solve one tiny matte so pymatting's numba kernels are compiled up front."""
+    mask = np.zeros((32, 32), np.uint8)
+    mask[8:24, 8:24] = 255
+    tri = trimap(mask, 240, 10, 3)
+    _solve(np.random.default_rng(0).integers(0, 256, (32, 32, 3)).astype(np.uint8), tri)
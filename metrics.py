@@ -0,0 +1,171 @@
+"""
+Minimal Prometheus instrumentation.
+
+Counters, gauges and histograms are plain Python objects guarded by a lock, so
+recording a value on the hot path is a dict lookup and an addition. render()
+produces the Prometheus text exposition format for the /metrics endpoint.
+Values that already live elsewhere (cache counters, disk usage, queue depth)
+are registered as callbacks and read only when metrics are scraped.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'bgremover_'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = self._header()
+        for key, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, ([*counts], total, count))
+                            for key, (counts, total, count) in self._values.items())
+        lines = self._header()
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Callback(_Metric):
+    """A metric whose values are read from callback() at scrape time.
+
+    callback returns a number, or a dict mapping label value tuples to numbers.
+    """
+
+    def __init__(self, name, documentation, callback, labelnames=(), type='gauge'):
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self._callback = callback
+
+    def render(self):
+        values = self._callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = self._header()
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+def render():
+    lines = []
+    for metric in list(_registry):
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            lines.append(f'# {metric.name} unavailable: {_escape(e)}')
+    return '\n'.join(lines) + '\n'
+
+
+# Metrics recorded by the shared pipeline modules
+STAGE_SECONDS = Histogram('stage_seconds', 'Time spent in each pipeline stage.', ['stage'])
+MODEL_LOAD_SECONDS = Gauge('model_load_seconds', 'Time taken to load each model session.', ['model'])
+BATCH_SIZE = Histogram('batch_size', 'Images per batched model run.', ['model'],
+                       buckets=(1, 2, 4, 8, 16, 32, 64))
+ERRORS = Counter('errors_total', 'Errors by exception type.', ['type'])
@@ -0,0 +1,147 @@
+"""
+Background removal pipeline shared by every route that processes images.
+
+Mirrors rembg.remove() for byte input, but gets the mask through the
+micro-batching scheduler so concurrent requests share model runs.
+
+Large photos are decoded at reduced scale for inference (JPEG DCT scaling via
+draft(), then reduce()), and only the final mask is brought back to full
+resolution and applied to the full-size pixels once, at the end. Very large
+images and panoramas can instead be predicted in full-resolution tiles; see
+tiling.py. Animated GIF, APNG and WebP files and MP4 clips are handed to
+animation.py frame by frame.
+
+Alpha matting is opt-in and runs at full resolution under a time budget; see
+matting.py. Callers can also ask for just the alpha mask, and/or for the
+result cropped to the subject's bounding box, which shrinks the cutout,
+matting and encode work in proportion to the empty area removed.
+"""
+
+import io
+
+from PIL import Image
+from rembg.bg import fix_image_orientation, naive_cutout
+
+import animation
+import config
+import encoding
+import matting
+import tiling
+from batching import predict_mask
+from masks import crop_box, upsample_mask
+from metrics import ERRORS, STAGE_SECONDS
+
+
+def _open(data):
+    return Image.open(io.BytesIO(data))
+
+
+def downscaled(data, max_side):
+    """Decode an image so that its longest side is close to max_side."""
+    img = _open(data)
+    width, height = img.size
+
+    # JPEG can decode straight at 1/2, 1/4 or 1/8 scale; draft() picks the
+    # smallest scale that still covers the requested size
+    scale = max_side / max(width, height)
+    img.draft('RGB', (max(1, int(width * scale)), max(1, int(height * scale))))
+
+    factor = max(img.size) // max_side
+    if factor > 1:
+        if img.mode not in ('RGB', 'RGBA', 'L'):
+            img = img.convert('RGB')
+        img = img.reduce(factor)
+    return img
+
+
+def remove_background(data, model_name=None, alpha_matting=False, output_format='png',
+                      mask_only=False, crop=None, tiled=False):
+    """Remove the background from encoded image bytes and return the encoded cutout.
+
+    mask_only returns the single-channel alpha mask instead of the RGBA cutout;
+    crop, if not None, is the padding in pixels kept around the subject's
+    bounding box; tiled predicts the mask in full-resolution tiles when the
+    image is larger than one tile (large images may also be tiled automatically).
+    """
+    return remove_background_outcome(data, model_name, alpha_matting, output_format, mask_only, crop, tiled)[0]
+
+
+def remove_background_outcome(data, model_name=None, alpha_matting=False, output_format='png',
+                              mask_only=False, crop=None, tiled=False):
+    """Like remove_background(), but return (encoded cutout, matted).
+
+    matted is None when no alpha matting was done (not requested, or an
+    animation), True when the edges were refined and False when matting fell
+    back to the plain mask (no band, time budget, band too large or unsolvable).
+    """
+    try:
+        with STAGE_SECONDS.time(stage='total'):
+            clip = animation.frames(data)
+            if clip is not None:
+                # Alpha matting and tiling are too costly per frame and are skipped
+                return animation.remove_background(*clip, model_name=model_name, output_format=output_format,
+                                                   mask_only=mask_only, crop=crop), None
+            return _remove_background(data, model_name, alpha_matting, output_format,
+                                      mask_only, crop, tiled)
+    except Exception as e:
+        ERRORS.inc(type=type(e).__name__)
+        raise
+
+
+def _remove_background(data, model_name, alpha_matting, output_format, mask_only, crop, tiled):
+    with STAGE_SECONDS.time(stage='decode'):
+        full = _open(data)
+        tiled = tiling.applies(full.size, tiled)
+        # Downscaling only pays off once the image can be reduced at least 2x
+        if max(full.size) >= 2 * config.INFERENCE_MAX_SIDE:
+            img = fix_image_orientation(downscaled(data, config.INFERENCE_MAX_SIDE))
+        else:
+            img = full = fix_image_orientation(full)
+        img.load()
+
+    with STAGE_SECONDS.time(stage='inference'):
+        mask = predict_mask(img, model_name)
+
+    if tiled:
+        with STAGE_SECONDS.time(stage='tiling'):
+            if img is not full:
+                full = fix_image_orientation(full)
+            # The coarse mask only guides the tiles; the result is full size
+            mask = tiling.predict_tiled(full, mask, model_name)
+            img = full
+
+    with STAGE_SECONDS.time(stage='postprocess'):
+        if img is not full:
+            full = fix_image_orientation(full)
+            mask = upsample_mask(mask, img.convert('L'), full.convert('L'))
+
+        box = crop_box(mask, crop) if crop is not None else None
+        if box is not None:
+            full = full.crop(box)
+            mask = mask.crop(box)
+
+        cutout = matted = None
+        if alpha_matting:
+            with STAGE_SECONDS.time(stage='matting'):
+                cutout = matting.matting_cutout(full, mask, config.MATTING_BUDGET_MS / 1000)
+            matted = cutout is not None
+        if mask_only:
+            cutout = mask if cutout is None else cutout.getchannel('A')
+        elif cutout is None:
+            cutout = naive_cutout(full, mask)
+
+    with STAGE_SECONDS.time(stage='encode'):
+        return encoding.encode(cutout, output_format), matted
+
+
+def warmup(model_name=None):
+    """Load a model and run one small image through it.
+
+    The first run of an onnxruntime session is much slower than the following
+    ones (memory arena allocation, kernel selection); doing it at startup keeps
+    that cost out of the first real request.
+    """
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (255, 255, 255)).save(buffer, 'PNG')
+    remove_background(buffer.getvalue(), model_name)
+    matting.warmup()
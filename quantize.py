@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Build INT8 quantized variants of the segmentation models and measure them.
+
+Usage:
+    python quantize.py MODEL [MODEL ...] [--images 2.png ...] [--repeat 5]
+                       [--per-channel] [--skip-existing]
+
+For every model, writes an INT8 dynamic-quantized copy of the FP32 ONNX file
+next to it (or into QUANTIZED_MODEL_DIR), then runs both versions over the
+sample images and reports the mask IoU of the INT8 output against the FP32
+output and the inference speedup. The speedup is measured on the model run
+alone, over inputs normalised once up front, so resizing does not dilute it
+(models without a known normalisation are timed through predict()). Once
+generated, the quantized model can be selected as "<model>-int8" (add it to
+ALLOWED_MODELS to expose it over HTTP).
+
+onnxruntime's quantization tools need the onnx package, which is not a
+dependency of onnxruntime or rembg: pip install onnx.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+from rembg.bg import fix_image_orientation
+
+from batching import normalization
+from sessions import QUANTIZED_SUFFIX, get_session, model_path, new_session
+
+try:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+except ImportError:
+    quantize_dynamic = None
+
+SAMPLE_IMAGES = ['2.png', '2462095_edited.jpg', '5fa375512b459.jpeg']
+
+
+def quantize(model_name, per_channel=False, skip_existing=False):
+    """Write the INT8 variant of a model and return its path."""
+    # Loading the FP32 session first makes rembg download the model if needed
+    get_session(model_name)
+    source = model_path(model_name)
+    target = model_path(model_name + QUANTIZED_SUFFIX)
+    if skip_existing and os.path.exists(target):
+        return target
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = target + '.tmp'
+    quantize_dynamic(source, tmp_path, per_channel=per_channel,
+                     weight_type=QuantType.QUInt8)
+    os.replace(tmp_path, target)
+    print(f"📦 {model_name}: {os.path.getsize(source) / 1e6:.1f} MB -> "
+          f"{os.path.getsize(target) / 1e6:.1f} MB ({target})")
+    return target
+
+
+def mask_iou(a, b, threshold=128):
+    a = np.asarray(a) >= threshold
+    b = np.asarray(b) >= threshold
+    union = np.logical_or(a, b).sum()
+    if union == 0:
+        return 1.0
+    return float(np.logical_and(a, b).sum() / union)
+
+
+def timed_run(session, img, repeat):
+    """Median seconds of one model run on img, preprocessing excluded."""
+    params = normalization(session.model_name)
+    if params is None:
+        run = lambda: session.predict(img)
+    else:
+        inputs = session.normalize(img, *params)
+        run = lambda: session.inner_session.run(None, inputs)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def compare(model_name, images, repeat):
+    fp32 = new_session(model_name)
+    int8 = new_session(model_name + QUANTIZED_SUFFIX)
+
+    rows = []
+    for path in images:
+        img = fix_image_orientation(Image.open(path)).convert('RGB')
+        # The full predictions are the masks compared; they also warm the sessions up
+        fp32_mask = fp32.predict(img)[0]
+        int8_mask = int8.predict(img)[0]
+        fp32_time = timed_run(fp32, img, repeat)
+        int8_time = timed_run(int8, img, repeat)
+        mean_abs_diff = np.abs(np.asarray(fp32_mask, dtype=np.int16)
+                               - np.asarray(int8_mask, dtype=np.int16)).mean() / 255
+        rows.append({
+            'image': os.path.basename(path),
+            'iou': mask_iou(fp32_mask, int8_mask),
+            'alpha_diff': float(mean_abs_diff),
+            'fp32_ms': fp32_time * 1000,
+            'int8_ms': int8_time * 1000,
+        })
+    return rows
+
+
+def report(model_name, rows):
+    print(f"\n{model_name} vs {model_name}{QUANTIZED_SUFFIX}")
+    print(f"{'image':<24}{'IoU':>8}{'Δalpha':>9}{'fp32 ms':>10}{'int8 ms':>10}{'speedup':>9}")
+    for row in rows:
+        print(f"{row['image']:<24}{row['iou']:>8.4f}{row['alpha_diff']:>9.4f}"
+              f"{row['fp32_ms']:>10.1f}{row['int8_ms']:>10.1f}"
+              f"{row['fp32_ms'] / row['int8_ms']:>8.2f}x")
+    if rows:
+        fp32_total = sum(row['fp32_ms'] for row in rows)
+        int8_total = sum(row['int8_ms'] for row in rows)
+        print(f"{'mean':<24}{statistics.fmean(row['iou'] for row in rows):>8.4f}"
+              f"{statistics.fmean(row['alpha_diff'] for row in rows):>9.4f}"
+              f"{fp32_total / len(rows):>10.1f}{int8_total / len(rows):>10.1f}"
+              f"{fp32_total / int8_total:>8.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Quantize segmentation models to INT8 and compare them.")
+    parser.add_argument('models', nargs='+')
+    parser.add_argument('--images', nargs='+', default=SAMPLE_IMAGES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--per-channel', action='store_true',
+                        help="quantize weights per output channel (slower to build, usually more accurate)")
+    parser.add_argument('--skip-existing', action='store_true',
+                        help="reuse quantized models that already exist")
+    args = parser.parse_args(argv)
+
+    if quantize_dynamic is None:
+        print("❌ Quantizing needs the onnx package: pip install onnx", file=sys.stderr)
+        return 1
+    for model_name in args.models:
+        quantize(model_name, args.per_channel, args.skip_existing)
+        report(model_name, compare(model_name, args.images, args.repeat))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
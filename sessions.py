@@ -0,0 +1,245 @@
+"""
+Model session pool.
+
+Calling rembg.remove() without a session builds a new onnxruntime
+InferenceSession on every call, reloading the model weights each time.
+Sessions created here are loaded lazily on first use, once per worker
+process, and shared by all request threads (InferenceSession.run is
+thread-safe).
+
+Several models can be resident at once. The pool is kept in LRU order and,
+once the combined size of the loaded models goes over MODEL_POOL_MAX_BYTES,
+the least recently used ones are dropped (never the one just requested).
+
+Every session is created with the onnxruntime settings from config (thread
+pools, graph optimization, memory arena, execution mode) rather than rembg's
+defaults.
+
+"<model>-int8" names the INT8 dynamic-quantized variant of a model, generated
+offline by quantize.py. It is loaded from a local file with the same session
+class (and therefore the same pre- and post-processing) as the FP32 model.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import onnxruntime as ort
+from rembg.sessions import sessions_class
+
+import config
+from metrics import MODEL_LOAD_SECONDS
+
+_sessions = OrderedDict()
+_sizes = {}
+_lock = threading.Lock()
+# Per-key locks held while a model loads, so only callers of that model wait for it
+_loading = {}
+_eviction_listeners = []
+
+
+def _freeze(providers):
+    # Providers may be plain names or (name, options) pairs; make them hashable
+    frozen = []
+    for provider in providers:
+        if isinstance(provider, (tuple, list)):
+            name, options = provider
+            frozen.append((name, tuple(sorted(options.items()))))
+        else:
+            frozen.append(provider)
+    return tuple(frozen)
+
+
+def _thaw(frozen):
+    return [(p[0], dict(p[1])) if isinstance(p, tuple) else p for p in frozen]
+
+
+QUANTIZED_SUFFIX = '-int8'
+
+_GRAPH_OPTIMIZATION = {
+    'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+_EXECUTION_MODE = {
+    'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def available_cpus():
+    # Honour CPU affinity (taskset, container cpusets) where the OS exposes it
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _choice(setting, value, choices):
+    if value not in choices:
+        raise ValueError(f"{setting} must be one of {', '.join(choices)}, not '{value}'")
+    return value
+
+
+def runtime_settings():
+    """The onnxruntime settings applied to every session, with "auto" resolved."""
+    execution_mode = _choice('ORT_EXECUTION_MODE', config.ORT_EXECUTION_MODE, _EXECUTION_MODE)
+
+    intra = config.ORT_INTRA_OP_THREADS
+    if str(intra) == 'auto':
+        intra = max(1, available_cpus() // max(1, config.WEB_CONCURRENCY))
+    inter = config.ORT_INTER_OP_THREADS
+    if str(inter) == 'auto':
+        # The inter-op pool is only used in parallel execution mode
+        inter = intra if execution_mode == 'parallel' else 1
+
+    return {
+        'intra_op_threads': int(intra),
+        'inter_op_threads': int(inter),
+        'graph_optimization': _choice('ORT_GRAPH_OPTIMIZATION', config.ORT_GRAPH_OPTIMIZATION,
+                                      _GRAPH_OPTIMIZATION),
+        'execution_mode': execution_mode,
+        'mem_arena': config.ORT_MEM_ARENA,
+        'workers': config.WEB_CONCURRENCY,
+    }
+
+
+def session_options():
+    settings = runtime_settings()
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = settings['intra_op_threads']
+    options.inter_op_num_threads = settings['inter_op_threads']
+    options.graph_optimization_level = _GRAPH_OPTIMIZATION[settings['graph_optimization']]
+    options.execution_mode = _EXECUTION_MODE[settings['execution_mode']]
+    options.enable_cpu_mem_arena = settings['mem_arena']
+    return options
+
+
+def base_model(model_name):
+    """The FP32 model a (possibly quantized) model name is derived from."""
+    if model_name.endswith(QUANTIZED_SUFFIX):
+        return model_name[:-len(QUANTIZED_SUFFIX)]
+    return model_name
+
+
+def _session_class(model_name):
+    for session_class in sessions_class:
+        if session_class.name() == model_name:
+            return session_class
+    raise ValueError(f"No session class found for model '{model_name}'")
+
+
+def model_path(model_name):
+    """Local path of a model's ONNX file."""
+    base = base_model(model_name)
+    if base != model_name:
+        directory = config.QUANTIZED_MODEL_DIR or _session_class(base).u2net_home()
+        return os.path.join(directory, f"{base}.int8.onnx")
+    # rembg stores every model it downloads as <U2NET_HOME>/<name>.onnx
+    return os.path.join(_session_class(base).u2net_home(), f"{base}.onnx")
+
+
+def fetch_model(model_name):
+    """Make sure a model's ONNX file is on disk, without creating a session."""
+    base = base_model(model_name)
+    if base != model_name:
+        # Quantized models are generated locally by quantize.py
+        return model_path(model_name)
+    return _session_class(base).download_models()
+
+
+def _quantized(session_class, path):
+    class QuantizedSession(session_class):
+        @classmethod
+        def download_models(cls, *args, **kwargs):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Quantized model not found at {path}; "
+                                        f"generate it with quantize.py")
+            return path
+
+    return QuantizedSession
+
+
+def new_session(model_name, **kwargs):
+    """rembg.new_session(), but with our session options instead of rembg's."""
+    session_class = _session_class(base_model(model_name))
+    if base_model(model_name) != model_name:
+        session_class = _quantized(session_class, model_path(model_name))
+    return session_class(model_name, session_options(), **kwargs)
+
+
+def _model_size(session):
+    # The weights file size is a good proxy for the resident size of the session
+    try:
+        return os.path.getsize(model_path(session.model_name))
+    except (OSError, ValueError):
+        return 0
+
+
+def on_evict(listener):
+    """Register listener(session) to be called when a session is dropped."""
+    _eviction_listeners.append(listener)
+
+
+def _evict_over_cap(keep):
+    evicted = []
+    while (config.MODEL_POOL_MAX_BYTES > 0 and len(_sessions) > 1
+           and sum(_sizes.values()) > config.MODEL_POOL_MAX_BYTES):
+        key = next(k for k in _sessions if k != keep)
+        evicted.append(_sessions.pop(key))
+        del _sizes[key]
+    return evicted
+
+
+def get_session(model_name=None, providers=None):
+    """Return the shared session for a model, loading it on first use."""
+    model_name = model_name or config.DEFAULT_MODEL
+    if providers is None:
+        providers = config.MODEL_PROVIDERS
+    key = (model_name, _freeze(providers))
+
+    with _lock:
+        session = _sessions.get(key)
+        if session is not None:
+            _sessions.move_to_end(key)
+            return session
+        loading = _loading.setdefault(key, threading.Lock())
+
+    # The load (possibly a download) runs outside _lock so lookups of loaded models never wait on it
+    with loading:
+        with _lock:
+            session = _sessions.get(key)
+            if session is not None:
+                # Another thread finished loading it while we waited
+                _sessions.move_to_end(key)
+                return session
+
+        print(f"🧠 Loading model '{model_name}'...")
+        kwargs = {'providers': _thaw(key[1])} if key[1] else {}
+        start = time.perf_counter()
+        session = new_session(model_name, **kwargs)
+        MODEL_LOAD_SECONDS.set(time.perf_counter() - start, model=model_name)
+        size = _model_size(session)
+        with _lock:
+            _sessions[key] = session
+            _sizes[key] = size
+            _loading.pop(key, None)
+            evicted = _evict_over_cap(key)
+
+    for old in evicted:
+        print(f"♻️  Unloading model '{old.model_name}' (model pool over its memory cap)")
+        for listener in _eviction_listeners:
+            listener(old)
+    return session
+
+
+def loaded_models():
+    """Names of the models currently held by the pool, least recently used first."""
+    with _lock:
+        return [model_name for model_name, _ in _sessions]
+
+
+def pool_bytes():
+    with _lock:
+        return sum(_sizes.values())
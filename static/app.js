@@ -0,0 +1,117 @@
+const uploadArea = document.getElementById('uploadArea');
+const fileInput = document.getElementById('fileInput');
+const form = document.getElementById('uploadForm');
+const loading = document.getElementById('loading');
+const fileInfo = document.getElementById('fileInfo');
+
+let selectedFile = null; // Store the selected file
+
+// Prevent default drag behaviors
+['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
+    uploadArea.addEventListener(eventName, preventDefaults, false);
+    document.body.addEventListener(eventName, preventDefaults, false);
+});
+
+// Highlight drop area when item is dragged over it
+['dragenter', 'dragover'].forEach(eventName => {
+    uploadArea.addEventListener(eventName, highlight, false);
+});
+
+['dragleave', 'drop'].forEach(eventName => {
+    uploadArea.addEventListener(eventName, unhighlight, false);
+});
+
+// Handle dropped files
+uploadArea.addEventListener('drop', handleDrop, false);
+
+// Handle file input change
+fileInput.addEventListener('change', function(e) {
+    if (this.files && this.files[0]) {
+        selectedFile = this.files[0];
+        showFileInfo(selectedFile);
+    }
+});
+
+// Handle click anywhere inside the upload area
+uploadArea.addEventListener('click', function(e) {
+    // Only trigger if it's not a drag operation
+    if (!uploadArea.classList.contains('dragover')) {
+        fileInput.click();
+    }
+});
+
+function preventDefaults(e) {
+    e.preventDefault();
+    e.stopPropagation();
+}
+
+function highlight(e) {
+    uploadArea.classList.add('dragover');
+}
+
+function unhighlight(e) {
+    uploadArea.classList.remove('dragover');
+}
+
+function handleDrop(e) {
+    const dt = e.dataTransfer;
+    const files = dt.files;
+
+    if (files.length > 0) {
+        selectedFile = files[0];
+
+        // Create a new FileList and assign to input
+        const dataTransfer = new DataTransfer();
+        dataTransfer.items.add(selectedFile);
+        fileInput.files = dataTransfer.files;
+
+        showFileInfo(selectedFile);
+    }
+}
+
+function showFileInfo(file) {
+    document.getElementById('fileName').textContent = file.name;
+    document.getElementById('fileSize').textContent = (file.size / (1024*1024)).toFixed(2) + ' MB';
+    fileInfo.style.display = 'block';
+
+    // Update upload area to show file is selected
+    uploadArea.style.borderColor = '#28a745';
+    uploadArea.style.backgroundColor = 'rgba(40, 167, 69, 0.1)';
+    uploadArea.querySelector('h3').textContent = '✅ File selected - Click "Remove Background" to process';
+}
+
+// Handle form submission
+form.addEventListener('submit', function(e) {
+    // Check if file is selected
+    if (!selectedFile || !fileInput.files || fileInput.files.length === 0) {
+        e.preventDefault();
+        alert('Please select an image file first!');
+        return false;
+    }
+
+    // Show loading state
+    loading.style.display = 'block';
+    form.style.display = 'none';
+
+    // Let the form submit normally
+    return true;
+});
+
+// Reset function for "Process Another Image" button
+function resetForm() {
+    selectedFile = null;
+    fileInput.value = '';
+    fileInfo.style.display = 'none';
+    uploadArea.style.borderColor = '#667eea';
+    uploadArea.style.backgroundColor = 'transparent';
+    uploadArea.querySelector('h3').textContent = 'Drop your image here or click to browse';
+    loading.style.display = 'none';
+    form.style.display = 'block';
+}
+
+// Auto-reset if there's an error message
+if (document.body.dataset.messageType === 'error') {
+    setTimeout(function() {
+        resetForm();
+    }, 100);
+}
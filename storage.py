@@ -0,0 +1,181 @@
+"""
+Bounded on-disk store for processed images.
+
+Results are kept as <file_id>.<format> files in a single directory. Reading a result
+sets its access time, so the atime serves as the last-access time and the store
+can be shared by several worker processes without a shared index. The mtime is
+left alone: it stays the creation time, which is what HTTP Last-Modified reports.
+A background janitor thread removes results that have not been accessed for
+RESULT_TTL seconds, then the least recently used ones until the directory is
+back under RESULT_MAX_BYTES.
+
+A result never changes once written, so its content hash serves as a strong
+HTTP ETag. Hashes are remembered per process (computed on write, or on the
+first read by another worker) so serving a result does not re-read it.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+_FILE_ID = re.compile(r'^[A-Za-z0-9_-]+$')
+# Number of result hashes remembered for ETags
+_ETAG_ENTRIES = 10000
+
+
+class ResultStore:
+    def __init__(self, directory, ttl, max_bytes, extensions=('.png',)):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.extensions = tuple(extensions)
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._etags = OrderedDict()
+        self._stop = threading.Event()
+        self._janitor = None
+        self.evictions = {'ttl': 0, 'size': 0}
+        self.files = 0
+        self.bytes = 0
+        self.sweep()
+
+    def _path(self, file_id, extension):
+        if not _FILE_ID.match(file_id):
+            return None
+        return os.path.join(self.directory, file_id + extension)
+
+    def _find(self, file_id):
+        for extension in self.extensions:
+            path = self._path(file_id, extension)
+            if path is None:
+                return None
+            if os.path.exists(path):
+                return path
+        return None
+
+    def put(self, file_id, data, extension='.png'):
+        """Atomically write a result so readers never see a partial file."""
+        if extension not in self.extensions:
+            raise ValueError(f"Unsupported extension: {extension}")
+        path = self._path(file_id, extension)
+        if path is None:
+            raise ValueError(f"Invalid file id: {file_id}")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._remember_etag(path, hashlib.sha256(data).hexdigest())
+        with self._lock:
+            self.files += 1
+            self.bytes += len(data)
+
+    def _remember_etag(self, path, etag):
+        with self._lock:
+            self._etags[path] = etag
+            self._etags.move_to_end(path)
+            while len(self._etags) > _ETAG_ENTRIES:
+                self._etags.popitem(last=False)
+
+    def etag(self, path):
+        """Content hash of a stored result, for use as its ETag."""
+        with self._lock:
+            etag = self._etags.get(path)
+        if etag is None:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            etag = digest.hexdigest()
+            self._remember_etag(path, etag)
+        return etag
+
+    def exists(self, file_id):
+        return self._find(file_id) is not None
+
+    def get_path(self, file_id):
+        """Return the path of a stored result and mark it as recently used."""
+        path = self._find(file_id)
+        if path is None:
+            return None
+        try:
+            # Set explicitly, as noatime and relatime mounts do not update it on read
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except FileNotFoundError:
+            return None
+        return path
+
+    def _scan(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(self.extensions):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+        return entries
+
+    def _remove(self, path, reason):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        self.evictions[reason] += 1
+        return True
+
+    def sweep(self):
+        """Evict expired results, then least recently used ones over the size cap."""
+        entries = self._scan()
+        cutoff = time.time() - self.ttl
+        kept = []
+        for atime, size, path in entries:
+            if self.ttl > 0 and atime < cutoff:
+                self._remove(path, 'ttl')
+            else:
+                kept.append((atime, size, path))
+
+        total = sum(size for _, size, _ in kept)
+        if self.max_bytes > 0 and total > self.max_bytes:
+            kept.sort()
+            while kept and total > self.max_bytes:
+                _, size, path = kept.pop(0)
+                self._remove(path, 'size')
+                total -= size
+
+        with self._lock:
+            self.files = len(kept)
+            self.bytes = total
+
+    def start_janitor(self, interval):
+        if self._janitor is not None:
+            return
+        self._janitor = threading.Thread(target=self._run_janitor, args=(interval,),
+                                         daemon=True, name='result-janitor')
+        self._janitor.start()
+
+    def stop_janitor(self):
+        self._stop.set()
+
+    def _run_janitor(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"❌ Janitor error: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': self.files,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'evictions': dict(self.evictions),
+            }
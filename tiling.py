@@ -0,0 +1,138 @@
+"""
+Tiled inference for very large images and panoramas.
+
+The segmentation models see a fixed input size (320x320 for u2net), so a
+whole panorama or 50 MP photo is squeezed into a few hundred pixels and small
+objects and fine edges are lost. Here the full-resolution image is cut into
+overlapping tiles, each tile is predicted on its own (the tiles of one row
+share batched model runs) and the tile masks are blended with linear feathers
+across the overlaps, so no seams show.
+
+The coarse mask of the whole image, predicted as usual, provides the global
+context: tiles it shows as all background or all foreground are filled in
+without running the model, and each tile's mask is limited to the dilated
+coarse foreground, so a tile cannot pick a background object as its subject.
+
+Stitching runs one row of tiles at a time. Only the rows the next tile row
+still overlaps are kept as floats; everything above them is written to the
+8-bit result straight away, so the working set stays at about one tile row
+however tall the image is.
+"""
+
+import math
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import config
+from batching import predict_masks
+
+# Coarse mask levels treated as sure background / sure foreground
+_BACKGROUND = 10
+_FOREGROUND = 245
+# Coarse pixels the foreground gate is grown by around the coarse subject
+_GATE_MARGIN = 8
+
+
+def applies(size, requested=False):
+    """Whether an image of this size should be processed in tiles."""
+    longest, shortest = max(size), max(1, min(size))
+    if longest <= config.TILE_SIZE:
+        return False
+    if requested:
+        return True
+    if config.TILED_AUTO_SIDE and longest >= config.TILED_AUTO_SIDE:
+        return True
+    return bool(config.TILED_AUTO_ASPECT) and longest / shortest >= config.TILED_AUTO_ASPECT
+
+
+def _starts(length, tile, overlap):
+    """Offsets of tiles covering length, neighbours sharing at least overlap pixels."""
+    if length <= tile:
+        return [0]
+    step = tile - overlap
+    count = math.ceil((length - overlap) / step)
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+
+def _feather(starts, index, size):
+    """1-D blend weights of one tile: linear ramps across the overlaps with its neighbours."""
+    weights = np.ones(size, np.float32)
+    start = starts[index]
+    if index > 0:
+        width = starts[index - 1] + size - start
+        ramp = (np.arange(width, dtype=np.float32) + 0.5) / width
+        weights[:width] = np.minimum(weights[:width], ramp)
+    if index < len(starts) - 1:
+        width = start + size - starts[index + 1]
+        ramp = (np.arange(width, dtype=np.float32)[::-1] + 0.5) / width
+        weights[size - width:] = np.minimum(weights[size - width:], ramp)
+    return weights
+
+
+def _coarse_region(coarse, box, scale_x, scale_y):
+    left, top, right, bottom = box
+    return coarse[int(top * scale_y):max(int(top * scale_y) + 1, math.ceil(bottom * scale_y)),
+                  int(left * scale_x):max(int(left * scale_x) + 1, math.ceil(right * scale_x))]
+
+
+def predict_tiled(img, coarse_mask, model_name=None):
+    """Predict the full-resolution L mask of img tile by tile.
+
+    coarse_mask is the mask predicted for the whole image at any smaller size.
+    """
+    width, height = img.size
+    overlap = min(config.TILE_OVERLAP, config.TILE_SIZE // 2)
+    tile_width, tile_height = min(config.TILE_SIZE, width), min(config.TILE_SIZE, height)
+    xs = _starts(width, tile_width, overlap)
+    ys = _starts(height, tile_height, overlap)
+    feather_x = [_feather(xs, i, tile_width) for i in range(len(xs))]
+    feather_y = [_feather(ys, j, tile_height) for j in range(len(ys))]
+
+    coarse = np.asarray(coarse_mask)
+    scale_x, scale_y = coarse.shape[1] / width, coarse.shape[0] / height
+    kernel = np.ones((2 * _GATE_MARGIN + 1, 2 * _GATE_MARGIN + 1), np.uint8)
+    gate = cv2.dilate((coarse > _BACKGROUND).astype(np.uint8) * 255, kernel)
+
+    out = np.empty((height, width), np.uint8)
+    band = weight = None
+    band_top = 0
+    for j, y0 in enumerate(ys):
+        # Carry the rows the previous tile row left unfinished into the new band
+        new_band = np.zeros((tile_height, width), np.float32)
+        new_weight = np.zeros((tile_height, width), np.float32)
+        if band is not None:
+            carried = band_top + tile_height - y0
+            new_band[:carried] = band[y0 - band_top:]
+            new_weight[:carried] = weight[y0 - band_top:]
+        band, weight, band_top = new_band, new_weight, y0
+
+        boxes = [(x0, y0, x0 + tile_width, y0 + tile_height) for x0 in xs]
+        masks = [None] * len(boxes)
+        pending = []
+        for i, box in enumerate(boxes):
+            region = _coarse_region(coarse, box, scale_x, scale_y)
+            if region.max() < _BACKGROUND:
+                masks[i] = np.zeros((tile_height, tile_width), np.float32)
+            elif region.min() > _FOREGROUND:
+                masks[i] = np.full((tile_height, tile_width), 255, np.float32)
+            else:
+                pending.append(i)
+        if pending:
+            predicted = predict_masks([img.crop(boxes[i]).convert('RGB') for i in pending], model_name)
+            for i, mask in zip(pending, predicted):
+                tile_gate = cv2.resize(_coarse_region(gate, boxes[i], scale_x, scale_y),
+                                       (tile_width, tile_height), interpolation=cv2.INTER_LINEAR)
+                masks[i] = np.minimum(np.asarray(mask), tile_gate).astype(np.float32)
+
+        for x0, fx, mask in zip(xs, feather_x, masks):
+            weights = feather_y[j][:, None] * fx[None, :]
+            band[:, x0:x0 + tile_width] += mask * weights
+            weight[:, x0:x0 + tile_width] += weights
+
+        # Rows above the next tile row are final
+        done = (ys[j + 1] if j + 1 < len(ys) else height) - y0
+        out[y0:y0 + done] = np.clip(band[:done] / weight[:done] + 0.5, 0, 255).astype(np.uint8)
+
+    return Image.fromarray(out, mode='L')
@@ -0,0 +1,97 @@
+"""
+Upload ingestion.
+
+Werkzeug spools multipart file parts to a temporary file as they arrive, and
+MAX_CONTENT_LENGTH makes it reject oversized bodies before they are buffered.
+read_upload() then checks the image (or MP4 clip) signature from the first
+bytes and the size from the spooled file before reading the upload into a
+single buffer for the decoder.
+"""
+
+import os
+
+from PIL import Image
+
+_CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of the formats the upload form accepts
+_SIGNATURES = [
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'BM', 'BMP'),
+]
+# Major brands of ISO base media files (an ftyp box after the size) that are
+# MP4 video; AVIF and HEIF stills share the container but are decoded by Pillow
+_VIDEO_BRANDS = {b'isom', b'iso2', b'iso4', b'iso5', b'iso6', b'mp41', b'mp42', b'avc1', b'M4V ', b'dash'}
+_IMAGE_BRANDS = {b'avif': 'AVIF', b'avis': 'AVIF', b'heic': 'HEIF', b'heix': 'HEIF', b'mif1': 'HEIF',
+                 b'msf1': 'HEIF'}
+
+
+class UploadError(Exception):
+    """An upload that was rejected before decoding; carries the HTTP status."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def sniff_image_type(head):
+    """Return the image format named by the leading bytes, or None."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in _VIDEO_BRANDS:
+            return 'MP4'
+        kind = _IMAGE_BRANDS.get(brand)
+        # Only when the installed Pillow (or a plugin) can decode it
+        Image.init()
+        return kind if kind in Image.OPEN else None
+    for signature, kind in _SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    return None
+
+
+def _size(stream):
+    try:
+        start = stream.tell()
+        end = stream.seek(0, os.SEEK_END)
+        stream.seek(start)
+        return end - start
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def read_upload(file, max_size):
+    """Validate an uploaded FileStorage and return its contents as bytes."""
+    stream = file.stream
+    too_large = UploadError(f"File too large. Maximum size is {max_size // (1024 * 1024)}MB", 413)
+    size = _size(stream)
+    if size is not None and size > max_size:
+        raise too_large
+
+    head = stream.read(16)
+    if sniff_image_type(head) is None:
+        raise UploadError("Unsupported file type. Please upload a JPG, PNG, GIF, BMP or WebP image or an MP4 clip", 415)
+
+    if size is not None:
+        # Read the whole file in one go into a single buffer
+        stream.seek(-len(head), os.SEEK_CUR)
+        return stream.read(size)
+
+    # Non-seekable stream: count bytes as they are read
+    chunks = [head]
+    total = len(head)
+    while True:
+        chunk = stream.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_size:
+            raise too_large
+        chunks.append(chunk)
+    return b''.join(chunks)
@@ -0,0 +1,9 @@
+"""
+WSGI entry point for production servers.
+
+Run with: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from app import create_app
+
+app = create_app()